@@ -0,0 +1,44 @@
+import argparse
+import json
+
+
+def compare(baseline: dict, candidate: dict, metric: str = "p50") -> list:
+    """
+        Compare two benchmark results.
+    :return: [(size, benchmark, baseline ms, candidate ms, candidate / baseline), ...]
+    """
+    result = []
+    baseline_sizes = {"startup": baseline.get("startup", {}), **baseline["sizes"]}
+    candidate_sizes = {"startup": candidate.get("startup", {}), **candidate["sizes"]}
+
+    for size, benchmarks in candidate_sizes.items():
+        for name, stats in benchmarks.items():
+            old = baseline_sizes.get(size, {}).get(name, {}).get(metric)
+            new = stats.get(metric)
+            result.append((size, name, old, new, new / old if old and new is not None else None))
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metric", default="p50", choices=["min", "mean", "p50", "p95", "p99", "max"])
+    args = parser.parse_args()
+
+    with open(args.baseline) as baseline, open(args.candidate) as candidate:
+        rows = compare(json.load(baseline), json.load(candidate), args.metric)
+
+    print(f"{'size':>10}  {'benchmark':<24}{'baseline, ms':>14}{'candidate, ms':>15}{'ratio':>8}")
+    for size, name, old, new, ratio in rows:
+        print(
+            f"{size:>10}  {name:<24}"
+            f"{'-' if old is None else f'{old:.2f}':>14}"
+            f"{'-' if new is None else f'{new:.2f}':>15}"
+            f"{'-' if ratio is None else f'{ratio:.2f}':>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
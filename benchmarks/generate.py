@@ -0,0 +1,233 @@
+from functions import copy_rows, refresh_statistics
+from grosland.app import bump_data_version, datastore, get_engine, init_db, session
+from grosland.models import Cadastre, Archive, Land, Ownership, Purpose, District, Council, Village, Roles, Users
+import math
+import random
+from sqlalchemy import text
+
+
+#   Parameters ---------------------------------------------------------------------------------------------------------
+ORIGIN = (29.60, 46.80)
+PARCEL_SIZE = (0.0013, 0.0009)
+
+OWNERSHIP = {
+    "100": "приватна",
+    "200": "комунальна",
+    "300": "державна",
+}
+
+PURPOSE = {
+    "01.01": "Для ведення товарного сільськогосподарського виробництва",
+    "01.02": "Для ведення фермерського господарства",
+    "01.03": "Для ведення особистого селянського господарства",
+    "01.05": "Для індивідуального садівництва",
+    "02.01": "Для будівництва і обслуговування житлового будинку",
+    "16.00": "Землі запасу",
+}
+
+VILLAGES = ("Велика Михайлівка", "Степанівка", "Новоселівка", "Кучурган")
+
+USER_EMAIL = "benchmark@grosland.local"
+USER_ROLES = ("admin", "cadastral_map")
+
+LAYERS = (Cadastre, Archive, Land, Village, Council, District)
+PARCEL_COLUMNS = ("cadnum", "ownership_code", "purpose_code", "area", "address", "geometry")
+ATU_COLUMNS = ("code", "desc", "area", "address", "geometry")
+
+
+#   Geometry -----------------------------------------------------------------------------------------------------------
+def cadnum(koatuu: str, index: int, zone: int = 1) -> str:
+    """
+        Valid cadastral number "KOATUU:zone:quarter:parcel" of the parcel with the index.
+    """
+    return f"{koatuu}:{zone + index // 10_000_000:02d}:{index // 10_000 % 1000:03d}:{index % 10_000:04d}"
+
+
+def grid(n: int) -> int:
+    return max(math.ceil(math.sqrt(n)), 1)
+
+
+def cell(index: int, columns: int) -> tuple:
+    """
+        South-west corner of the grid cell with the index.
+    """
+    return ORIGIN[0] + index % columns * PARCEL_SIZE[0], ORIGIN[1] + index // columns * PARCEL_SIZE[1]
+
+
+def parcel_polygon(x: float, y: float, rnd: random.Random) -> list:
+    """
+        Irregular quadrilateral with extra vertices on its edges inside the grid cell.
+    """
+    dx, dy = PARCEL_SIZE
+    corners = [
+        (x + dx * rnd.uniform(0.02, 0.1), y + dy * rnd.uniform(0.02, 0.1)),
+        (x + dx * rnd.uniform(0.9, 0.98), y + dy * rnd.uniform(0.02, 0.1)),
+        (x + dx * rnd.uniform(0.9, 0.98), y + dy * rnd.uniform(0.9, 0.98)),
+        (x + dx * rnd.uniform(0.02, 0.1), y + dy * rnd.uniform(0.9, 0.98)),
+    ]
+
+    ring = []
+    for index, (x1, y1) in enumerate(corners):
+        x2, y2 = corners[(index + 1) % len(corners)]
+        ring.append((x1, y1))
+        for step in range(rnd.randint(0, 3)):
+            t = (step + 1) / 5
+            ring.append((x1 + (x2 - x1) * t, y1 + (y2 - y1) * t))
+    ring.append(ring[0])
+
+    return ring
+
+
+def rectangle(x1: float, y1: float, x2: float, y2: float) -> list:
+    return [(x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1)]
+
+
+def ewkt(ring: list) -> str:
+    return "SRID=4326;MULTIPOLYGON(((" + ", ".join(f"{x:.8f} {y:.8f}" for x, y in ring) + ")))"
+
+
+def ring_area(ring: list) -> float:
+    """
+        Approximate area of the ring in hectares.
+    """
+    lat = math.radians(sum(y for _, y in ring) / len(ring))
+    area = abs(sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:]))) / 2
+
+    return round(area * 111_320 * math.cos(lat) * 110_574 / 10_000, 4)
+
+
+#   Rows ---------------------------------------------------------------------------------------------------------------
+def parcels(koatuu: str, n: int, columns: int, seed: int, zone: int, offset: int = 0):
+    """
+        Synthetic parcels with the ring of their outer boundary.
+    :return: Generator of {"cadnum": str, ..., "ring": [(x, y), ...]}
+    """
+    rnd = random.Random(seed)
+    ownership, purpose = list(OWNERSHIP), list(PURPOSE)
+
+    for index in range(n):
+        ring = parcel_polygon(*cell(index + offset, columns), rnd)
+        village = VILLAGES[rnd.randrange(len(VILLAGES))]
+
+        yield {
+            "cadnum": cadnum(koatuu, index, zone),
+            "ownership_code": rnd.choices(ownership, weights=(70, 10, 20))[0],
+            "purpose_code": rnd.choice(purpose),
+            "area": ring_area(ring),
+            "address": f"Одеська область, Роздільнянський район, с. {village}",
+            "ring": ring,
+        }
+
+
+def parcel_rows(koatuu: str, n: int, columns: int, seed: int, zone: int, offset: int = 0):
+    for parcel in parcels(koatuu, n, columns, seed, zone, offset):
+        yield (*(parcel[column] for column in PARCEL_COLUMNS[:-1]), ewkt(parcel["ring"]))
+
+
+def land_rows(n: int, columns: int, seed: int):
+    rnd = random.Random(seed)
+
+    for index in range(n):
+        ring = parcel_polygon(*cell(rnd.randrange(columns * columns), columns), rnd)
+        yield str(index + 1), "0", "00.00", ring_area(ring), USER_EMAIL, ewkt(ring)
+
+
+def atu_rows(koatuu: str, columns: int):
+    """
+        District and council around the whole grid, villages split it into equal parts.
+    """
+    x1, y1 = ORIGIN
+    x2, y2 = ORIGIN[0] + columns * PARCEL_SIZE[0], ORIGIN[1] + columns * PARCEL_SIZE[1]
+    side = math.ceil(math.sqrt(len(VILLAGES)))
+
+    district = rectangle(x1 - 0.01, y1 - 0.01, x2 + 0.01, y2 + 0.01)
+    council = rectangle(x1, y1, x2, y2)
+    villages = []
+
+    for index, name in enumerate(VILLAGES):
+        vx, vy = x1 + (x2 - x1) * (index % side) / side, y1 + (y2 - y1) * (index // side) / side
+        ring = rectangle(vx, vy, vx + (x2 - x1) / side, vy + (y2 - y1) / side)
+        villages.append((f"{koatuu[:8]}{index + 1:02d}", name, ring_area(ring), None, ewkt(ring)))
+
+    return {
+        District: [(koatuu[:5] + "00000", "Роздільнянський район", ring_area(district), None, ewkt(district))],
+        Council: [(koatuu[:8] + "00", "Benchmark council", ring_area(council), None, ewkt(council))],
+        Village: villages,
+    }
+
+
+#   Generate -----------------------------------------------------------------------------------------------------------
+def check_database(force: bool = False):
+    """
+        The generator truncates the lots and ATU tables, so it runs only against a benchmark database.
+    """
+    database = get_engine().url.database or ""
+
+    if not force and not database.endswith("_bench"):
+        raise RuntimeError(f"Database {database!r} is not a benchmark database (*_bench), use --force to override")
+
+
+def create_parameters():
+    """
+        Ownership, purpose codes and the benchmark user with all roles.
+    """
+    for model, values in ((Ownership, {**OWNERSHIP, "0": "невизначена"}), (Purpose, {**PURPOSE, "00.00": "-"})):
+        for code, desc in values.items():
+            session.execute(
+                text(f'INSERT INTO {model.__tablename__} (code, "desc") VALUES (:code, :desc) ON CONFLICT DO NOTHING'),
+                {"code": code, "desc": desc}
+            )
+
+    roles = []
+    for name in USER_ROLES:
+        role = session.query(Roles).filter_by(name=name).first()
+        if role is None:
+            role = Roles(name=name, code=name, desc=name)
+            session.add(role)
+        roles.append(role)
+
+    user = session.query(Users).filter_by(email=USER_EMAIL).first()
+    if user is None:
+        datastore.create_user(
+            name="Benchmark", surname="Benchmark", email=USER_EMAIL, password="benchmark", roles=roles
+        )
+
+    session.commit()
+
+
+def generate(n: int, koatuu: str = "5121680800", seed: int = 0, force: bool = False) -> dict:
+    """
+        Replace lots and ATU with a synthetic dataset: n cadastre parcels, n / 10 archive parcels
+        and n / 100 user polygons on a regular grid with council and village boundaries around it.
+    :return: {"cadastre": int, "archive": int, "land": int}
+    """
+    check_database(force)
+    init_db()
+
+    tables = ", ".join(model.__tablename__ for model in LAYERS)
+    session.execute(text(f"TRUNCATE {tables} RESTART IDENTITY"))
+    session.commit()
+
+    create_parameters()
+
+    columns = grid(n)
+
+    #   ATU first, so that the plots are assigned to councils and villages on insert
+    for model, rows in atu_rows(koatuu, columns).items():
+        copy_rows(model.__tablename__, ATU_COLUMNS, rows)
+
+    result = {
+        "cadastre": copy_rows(Cadastre.__tablename__, PARCEL_COLUMNS, parcel_rows(koatuu, n, columns, seed, 1)),
+        "archive": copy_rows(
+            Archive.__tablename__, PARCEL_COLUMNS, parcel_rows(koatuu, n // 10, columns, seed + 1, 50, n // 20)
+        ),
+        "land": copy_rows(Land.__tablename__, PARCEL_COLUMNS, land_rows(max(n // 100, 1), columns, seed + 2)),
+    }
+
+    with get_engine().connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(text(f"ANALYZE {tables}"))
+
+    bump_data_version(*(model.__tablename__ for model in (Cadastre, Archive, Land, Ownership, Purpose)))
+    refresh_statistics()
+
+    return result
@@ -0,0 +1,269 @@
+import os
+
+#   Views are measured without Flask-Caching, the data path is what matters
+os.environ.setdefault("CACHE_TYPE", "NullCache")
+
+import argparse
+from benchmarks.generate import cadnum, generate, grid, parcels, USER_EMAIL
+from collections import defaultdict
+import datetime
+import functions
+from grosland import create_app
+from grosland.app import session
+from grosland.models import Cadastre, Users
+import json
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+#   Imports the application the way a worker or a CLI command does, in a fresh interpreter
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import grosland
+imported = time.perf_counter()
+grosland.create_app()
+created = time.perf_counter()
+import functions
+print(json.dumps({
+    "import_grosland": imported - start,
+    "create_app": created - imported,
+    "import_functions": time.perf_counter() - created,
+}))
+"""
+
+
+#   Measure ------------------------------------------------------------------------------------------------------------
+def summary(timings: list, rows: int = None) -> dict:
+    """
+        Statistics of the timings in milliseconds.
+    """
+    timings = sorted(timings)
+    result = {
+        "n": len(timings),
+        "min": timings[0] * 1000,
+        "mean": statistics.fmean(timings) * 1000,
+        "p50": timings[int(len(timings) * 0.50)] * 1000,
+        "p95": timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+        "p99": timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1000,
+        "max": timings[-1] * 1000,
+    }
+
+    if rows is not None:
+        result["rows"] = rows
+        result["rows_per_second"] = rows / timings[0] if timings[0] else None
+
+    return result
+
+
+def measure(function, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        function()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return summary(timings)
+
+
+def once(function, rows: int) -> dict:
+    start = time.perf_counter()
+    function()
+    return summary([time.perf_counter() - start], rows)
+
+
+def login(client):
+    """
+        Authenticate the test client as the benchmark user.
+    """
+    user = session.query(Users).filter_by(email=USER_EMAIL).one()
+
+    with client.session_transaction() as flask_session:
+        flask_session["_user_id"] = user.fs_uniquifier
+        flask_session["_fresh"] = True
+
+
+def request(client, method: str, url: str, **kwargs):
+    response = client.open(url, method=method, **kwargs)
+    response.get_data()
+
+    if response.status_code >= 500:
+        raise RuntimeError(f"{method} {url}: {response.status_code}")
+
+    return response
+
+
+#   Benchmarks ---------------------------------------------------------------------------------------------------------
+def endpoint_benchmarks(client, n: int, koatuu: str, repeat: int, rnd: random.Random) -> dict:
+    cadnums = [cadnum(koatuu, rnd.randrange(n)) for _ in range(repeat * 2)]
+    cadnums += [cadnum(koatuu, rnd.randrange(max(n // 10, 1)), 50) for _ in range(repeat // 2)]
+    polygon = {
+        "type": "Feature",
+        "properties": {},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[29.6, 46.8], [29.601, 46.8], [29.601, 46.801], [29.6, 46.801], [29.6, 46.8]]]
+        }
+    }
+
+    return {
+        "get_parcel": measure(
+            lambda: request(client, "GET", f"/cadastral_map/parcels/{rnd.choice(cadnums)}"), repeat
+        ),
+        "get_parcels_cadnum": measure(
+            lambda: request(client, "GET", f"/cadastral_map/parcels/?cadnum=:{rnd.randrange(100):03d}:"), repeat
+        ),
+        "get_parcels_address": measure(
+            lambda: request(client, "GET", "/cadastral_map/parcels/?address=Степанівка"), repeat
+        ),
+        "get_parcels_area": measure(
+            lambda: request(client, "GET", "/cadastral_map/parcels/?area=>=1,1"), repeat
+        ),
+        "add_polygon": measure(
+            lambda: request(
+                client, "POST", "/cadastral_map/parcels", json={"geojson": json.dumps(polygon), "area": "1.0"}
+            ),
+            repeat
+        ),
+    }
+
+
+def startup_benchmarks(repeat: int) -> dict:
+    """
+        Import and application factory time of a fresh process. It needs no database.
+    """
+    timings = defaultdict(list)
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT], text=True)
+        timings["process"].append(time.perf_counter() - start)
+
+        for name, seconds in json.loads(output.splitlines()[-1]).items():
+            timings[name].append(seconds)
+
+    return {name: summary(values) for name, values in timings.items()}
+
+
+def job_benchmarks(n: int, koatuu: str, seed: int, directory: str) -> dict:
+    """
+        Maintenance jobs: import of n / 10 new parcels, their archiving and the comparison with a services list.
+    """
+    m = max(n // 10, 1)
+    geojson = os.path.join(directory, "import.geojson")
+
+    with open(geojson, "w", encoding="utf-8") as file:
+        file.write('{"type": "FeatureCollection", "features": [\n')
+        for index, parcel in enumerate(parcels(koatuu, m, grid(n), seed + 3, 90)):
+            ring = parcel.pop("ring")
+            file.write(("," if index else "") + json.dumps({
+                "type": "Feature",
+                "properties": parcel,
+                "geometry": {"type": "MultiPolygon", "coordinates": [[[list(point) for point in ring]]]},
+            }) + "\n")
+        file.write("]}\n")
+
+    delete_list = os.path.join(directory, "delete.txt")
+    with open(delete_list, "w") as file:
+        file.writelines(f"{cadnum(koatuu, index, 90)}\n" for index in range(m))
+
+    services = os.path.join(directory, "services.txt")
+    rnd = random.Random(seed)
+    with open(services, "w") as file:
+        file.writelines(f"{cadnum(koatuu, index)}\n" for index in range(n) if rnd.random() > 0.01)
+        file.writelines(f"{cadnum(koatuu, index, 95)}\n" for index in range(n // 100))
+
+    result = {
+        "create_db_object": once(lambda: functions.create_db_object(
+            file=geojson, layer="cadastre",
+            cadnum="cadnum", ownership_code="ownership_code", purpose_code="purpose_code",
+            area="area", address="address"
+        ), m),
+        "transfer_to_archive": once(lambda: functions.transfer_to_archive(delete_list), m),
+    }
+
+    result["get_parcels_write"] = once(lambda: functions.get_parcels(koatuu, Cadastre.__tablename__, write=True), n)
+
+    grosland_file = max(
+        (os.path.join("temp", name) for name in os.listdir("temp") if name.startswith(Cadastre.__tablename__)),
+        key=os.path.getmtime
+    )
+    result["list_comparison"] = once(lambda: functions.list_comparison(services, grosland_file), n)
+
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#   Main ---------------------------------------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Grosland benchmark on a synthetic cadastral dataset.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10_000, 100_000, 1_000_000],
+                        help="Dataset sizes, none to measure only the startup")
+    parser.add_argument("--koatuu", default="5121680800")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--startup-repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Path to the JSON results, by default bench_<commit>.json")
+    parser.add_argument("--force", action="store_true", help="Allow a database, whose name does not end with _bench")
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+    commit = git_commit()
+
+    results = {
+        "commit": commit,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "koatuu": args.koatuu,
+        "repeat": args.repeat,
+        "startup": startup_benchmarks(args.startup_repeat),
+        "sizes": {},
+    }
+
+    for n in args.sizes:
+        print(f"Generating {n} parcels")
+        start = time.perf_counter()
+        #   Jobs bump data versions in the cache of the application like CLI commands
+        with app.app_context():
+            rows = generate(n, args.koatuu, args.seed, args.force)
+        size = {"generate": summary([time.perf_counter() - start], sum(rows.values()))}
+
+        client = app.test_client()
+        login(client)
+        size.update(endpoint_benchmarks(client, n, args.koatuu, args.repeat, random.Random(args.seed)))
+
+        #   Jobs write to temp/ relative to the working directory
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory, app.app_context():
+            os.makedirs(os.path.join(directory, "temp"))
+            os.chdir(directory)
+            try:
+                size.update(job_benchmarks(n, args.koatuu, args.seed, directory))
+            finally:
+                os.chdir(cwd)
+
+        results["sizes"][str(n)] = size
+        session.remove()
+
+    output = args.output or f"bench_{(commit or 'unknown')[:10]}.json"
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"Results: {output}")
+
+
+if __name__ == "__main__":
+    main()
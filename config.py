@@ -19,3 +19,68 @@ class Config:
 
     SECURITY_PASSWORD_SALT = os.environ.get("SECURITY_PASSWORD_SALT")
     SECURITY_PASSWORD_HASH = os.environ.get("SECURITY_PASSWORD_HASH")
+
+    #   Replicas -------------------------------------------------------------------------------------------------------
+    #   Comma separated URIs of read replicas of SQLALCHEMY_DATABASE_URI used by the read-only blueprints
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get("SQLALCHEMY_REPLICA_URIS", "").split(",") if uri.strip()]
+    #   Seconds of reading from the primary after a write, must exceed the replication lag
+    REPLICA_STICKINESS = int(os.environ.get("REPLICA_STICKINESS", 10))
+
+    #   Cache ----------------------------------------------------------------------------------------------------------
+    CACHE_TYPE = os.environ.get("CACHE_TYPE", "FileSystemCache")
+    CACHE_DIR = os.environ.get("CACHE_DIR", join(dirname(__file__), "temp", "cache"))
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get("CACHE_DEFAULT_TIMEOUT", 3600))
+    CACHE_THRESHOLD = int(os.environ.get("CACHE_THRESHOLD", 10000))
+
+    #   Admin ----------------------------------------------------------------------------------------------------------
+    #   Lists of lots with more rows show the PostgreSQL estimate instead of the exact count
+    ADMIN_EXACT_COUNT_LIMIT = int(os.environ.get("ADMIN_EXACT_COUNT_LIMIT", 100000))
+
+    #   GeoJSON --------------------------------------------------------------------------------------------------------
+    GEOJSON_PRECISION = int(os.environ.get("GEOJSON_PRECISION", 8))
+    PARCELS_BATCH_LIMIT = int(os.environ.get("PARCELS_BATCH_LIMIT", 1000))
+
+    #   Metrics --------------------------------------------------------------------------------------------------------
+    METRICS_SLOW_QUERY_THRESHOLD = int(os.environ.get("METRICS_SLOW_QUERY_THRESHOLD", 500))
+    METRICS_EXPLAIN_SLOW_QUERIES = os.environ.get("METRICS_EXPLAIN_SLOW_QUERIES", "true").lower() == "true"
+
+    #   Search ---------------------------------------------------------------------------------------------------------
+    SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 1000))
+    SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 100000))
+
+    #   History --------------------------------------------------------------------------------------------------------
+    HISTORY_BATCH_SIZE = int(os.environ.get("HISTORY_BATCH_SIZE", 100))
+    HISTORY_FLUSH_INTERVAL = int(os.environ.get("HISTORY_FLUSH_INTERVAL", 1000))
+
+    #   Compression ----------------------------------------------------------------------------------------------------
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+
+    #   Spatial --------------------------------------------------------------------------------------------------------
+    SPATIAL_LIMIT = int(os.environ.get("SPATIAL_LIMIT", 500))
+    SPATIAL_MAX_LIMIT = int(os.environ.get("SPATIAL_MAX_LIMIT", 5000))
+
+    #   Tiles ----------------------------------------------------------------------------------------------------------
+    TILES_MIN_ZOOM = int(os.environ.get("TILES_MIN_ZOOM", 8))
+    TILES_MAX_ZOOM = int(os.environ.get("TILES_MAX_ZOOM", 18))
+    TILES_CACHE_DIR = os.environ.get("TILES_CACHE_DIR", join(dirname(__file__), "temp", "tiles"))
+    TILES_CACHE_MAX_SIZE = int(os.environ.get("TILES_CACHE_MAX_SIZE", 512 * 1024 * 1024))
+
+    #   Pre-rendered MBTiles package (manage.py build-mbtiles), tiles are served from it instead of the database
+    TILES_MBTILES = os.environ.get("TILES_MBTILES")
+
+    #   Serve the package without login and roles, for a local deployment without access to the users in PostgreSQL
+    TILES_LOCAL = os.environ.get("TILES_LOCAL", "").lower() in ("1", "true", "yes")
+
+    #   ASCM -----------------------------------------------------------------------------------------------------------
+    #   Markers are clustered up to this zoom, cells are ASCM_CLUSTER_SIZE pixels wide
+    ASCM_CLUSTER_MAX_ZOOM = int(os.environ.get("ASCM_CLUSTER_MAX_ZOOM", 13))
+    ASCM_CLUSTER_SIZE = int(os.environ.get("ASCM_CLUSTER_SIZE", 64))
+
+    #   Async ----------------------------------------------------------------------------------------------------------
+    #   Driver URI of grosland.asgi, by default SQLALCHEMY_DATABASE_URI with postgresql+asyncpg
+    ASYNC_DATABASE_URI = os.environ.get("ASYNC_DATABASE_URI")
+    ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", 20))
+    ASYNC_MAX_OVERFLOW = int(os.environ.get("ASYNC_MAX_OVERFLOW", 20))
@@ -1,51 +1,205 @@
 from config import Config
-from flask import Flask
+from flask import Flask, current_app, has_request_context, request, session as user_session
 from flask_admin import Admin
 from flask_caching import Cache
 from flask_security import Security, SQLAlchemySessionUserDatastore
+from grosland.assets import Assets
+from grosland.history import HistoryWriter
+from grosland.metrics import Metrics, TimedQueuePool
 from grosland.models import *
-from sqlalchemy import create_engine
+from grosland.replicas import Replicas, RoutingSession
+from itertools import chain
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import scoped_session, sessionmaker
+import time
+import uuid
 
 
-#   Flask --------------------------------------------------------------------------------------------------------------
-app = Flask(__name__)
-app.config.from_object(Config)
+#   Extensions ---------------------------------------------------------------------------------------------------------
+#   Created unbound, so that importing the package needs neither the configuration nor the database
+assets = Assets()
+cache = Cache()
+metrics = Metrics()
+history_writer = HistoryWriter()
+replicas = Replicas()
 
+session = scoped_session(sessionmaker(class_=RoutingSession))
+Base.query = session.query_property()
+
+datastore = SQLAlchemySessionUserDatastore(session, Users, Roles)
+security = Security()
 
-#   Flask-Caching ------------------------------------------------------------------------------------------------------
-cache = Cache(
-    app=app,
-    config={
-        "CACHE_TYPE": "simple",
-        "CACHE_DEFAULT_TIMEOUT": 3600
-    }
-)
+ADMIN_VIEWS = {
+    "User": ((Users, UsersView), (Roles, RolesView)),
+    "Parameters": ((Ownership, OwnershipView), (Category, CategoryView), (Purpose, PurposeView)),
+    "ATU": ((State, StateView), (District, DistrictView), (Council, CouncilView), (Village, VillageView)),
+    "Lots": ((Cadastre, CadastreView), (Archive, ArchiveView), (Land, LandView)),
+    "Points": ((ASCM, ASCMView),),
+    "Auxiliary": ((History, HistoryView), (Updates, UpdatesView)),
+}
 
 
 #   SQLAlchemy ---------------------------------------------------------------------------------------------------------
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
-Base.metadata.create_all(bind=engine)
-session = scoped_session(sessionmaker(bind=engine))
-Base.query = session.query_property()
+def get_engine():
+    """
+        Engine of the primary database, the session is bound to it by create_app.
+    """
+    return session.bind
 
 
-#   Flask-Security -----------------------------------------------------------------------------------------------------
-datastore = SQLAlchemySessionUserDatastore(session, Users, Roles)
-security = Security(app, datastore)
-
-
-#   Flask-Admin --------------------------------------------------------------------------------------------------------
-admin = Admin(app, index_view=AdminView())
-admin_tabs = {
-    "User": ["Users", "Roles"],
-    "Parameters": ["Ownership", "Category", "Purpose"],
-    "ATU": ["State", "District", "Council", "Village"],
-    "Lots": ["Cadastre", "Archive", "Land"],
-    "Points": ["ASCM"],
-    "Auxiliary": ["History", "Updates"],
-}
+def init_db():
+    """
+        Create missing tables with their triggers and views. Existing databases are upgraded by alembic.
+    """
+    Base.metadata.create_all(bind=get_engine())
+
+
+#   Data version -------------------------------------------------------------------------------------------------------
+DATA_VERSION_PREFIX = "data_version/"
+DATA_CHANGED_PREFIX = "data_changed/"
+VERSIONED_MODELS = (Cadastre, Archive, Land, Ownership, Purpose, District, Council, Village, ASCM)
+
+
+def get_data_version(*tables: str) -> str:
+    """
+        Current data version of the tables shared by all workers through the cache.
+        A missing version (e.g. evicted from the cache) is replaced by a new one, so stale entries are never reused.
+        A request, which keys its response on tables changed in the last REPLICA_STICKINESS seconds, reads from
+        the primary, so rows of a lagging replica are never cached under the new version.
+    :param tables: e.g. "cadastre", "archive"
+    :return: Version string to be used in cache keys
+    """
+    keys = [DATA_VERSION_PREFIX + table for table in tables]
+    values = cache.get_many(*keys, *(DATA_CHANGED_PREFIX + table for table in tables))
+    versions, changed = values[:len(tables)], values[len(tables):]
+
+    if has_request_context() and session.info.get("replica") is not None:
+        if time.time() < max((value or 0 for value in changed), default=0) + current_app.config["REPLICA_STICKINESS"]:
+            session.info.pop("replica")
+
+    for index, version in enumerate(versions):
+        if version is None:
+            cache.add(keys[index], uuid.uuid4().hex, timeout=0)
+            versions[index] = cache.get(keys[index])
+
+    return "-".join(str(version) for version in versions)
+
+
+def bump_data_version(*tables: str):
+    """
+        Invalidate all cached data of the tables.
+    """
+    now = time.time()
+
+    for table in tables:
+        cache.set(DATA_VERSION_PREFIX + table, uuid.uuid4().hex, timeout=0)
+        cache.set(DATA_CHANGED_PREFIX + table, now, timeout=0)
+
+
+def versioned_key(*tables: str):
+    """
+        Cache key prefix for views, which depends on the data version of the tables.
+    """
+    return lambda: f"view/{get_data_version(*tables)}{request.full_path}"
+
+
+@event.listens_for(session, "after_flush")
+def collect_changed_tables(db_session, flush_context):
+    """
+        Remember the tables changed by the flush. The version is bumped only after commit,
+        so other workers never cache old rows under the new version.
+    """
+    changed = db_session.info.setdefault("changed_tables", set())
+
+    for item in chain(db_session.new, db_session.dirty, db_session.deleted):
+        if isinstance(item, VERSIONED_MODELS):
+            changed.add(item.__tablename__)
+
+
+@event.listens_for(session, "after_commit")
+def bump_changed_tables(db_session):
+    bump_data_version(*db_session.info.pop("changed_tables", ()))
+
+
+@event.listens_for(session, "after_rollback")
+def forget_changed_tables(db_session):
+    db_session.info.pop("changed_tables", None)
+
+
+#   Replicas -----------------------------------------------------------------------------------------------------------
+PRIMARY_UNTIL = "_primary_until"
+
+
+def read_from_replica():
+    """
+        before_request hook of the read-only blueprints: GET requests read from the next replica.
+        The primary is used for REPLICA_STICKINESS seconds after the user's own writes, so they are always visible.
+        Views of recently changed tables switch back to the primary in get_data_version.
+    """
+    if request.method != "GET" or not replicas.engines:
+        return
+
+    if time.time() < user_session.get(PRIMARY_UNTIL, 0):
+        return
+
+    session.info["replica"] = replicas.next()
+
+
+@event.listens_for(session, "after_flush")
+def remember_write(db_session, flush_context):
+    db_session.info["written"] = True
+
+
+@event.listens_for(session, "after_commit")
+def stick_to_primary(db_session):
+    """
+        Read-your-writes: the user's next requests read from the primary.
+    """
+    if db_session.info.pop("written", False) and has_request_context():
+        user_session[PRIMARY_UNTIL] = time.time() + current_app.config["REPLICA_STICKINESS"]
+
+
+@event.listens_for(session, "after_rollback")
+def forget_write(db_session):
+    db_session.info.pop("written", None)
+
+
+#   Application --------------------------------------------------------------------------------------------------------
+def create_app(config=Config) -> Flask:
+    """
+        Application factory. The engine connects on the first query, the schema is created by "manage.py create-db".
+    :param config: Configuration object, e.g. Config or its subclass for tests and benchmarks.
+    """
+    from grosland.blueprints import api, cadastral_map, ascm_map, tiles
+    from grosland.main import main, shutdown_session
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    engine = create_engine(app.config["SQLALCHEMY_DATABASE_URI"], poolclass=TimedQueuePool)
+    session.remove()
+    session.configure(bind=engine)
+    replicas.init_app(app, poolclass=TimedQueuePool)
+
+    assets.init_app(app)
+    cache.init_app(app)
+    history_writer.init_app(app, engine)
+    metrics.init_app(app, engine)
+    for replica in replicas.engines:
+        metrics.instrument(replica)
+    metrics.gauge("grosland_history_queue_depth", "History rows waiting to be written.", lambda: history_writer.depth)
+    security.init_app(app, datastore)
+
+    admin = Admin(app, index_view=AdminView())
+    for category, views in ADMIN_VIEWS.items():
+        for model, view in views:
+            admin.add_view(view(model, session, category=category))
+
+    app.register_blueprint(main)
+    app.register_blueprint(api)
+    app.register_blueprint(cadastral_map)
+    app.register_blueprint(ascm_map)
+    app.register_blueprint(tiles)
+    app.teardown_appcontext(shutdown_session)
 
-for key, value in admin_tabs.items():
-    for _ in value:
-        eval(f"admin.add_view({_}View({_}, session, category='{key}'))")
+    return app
@@ -0,0 +1,403 @@
+from config import Config
+from grosland.app import create_app, get_data_version
+from grosland.blueprints.api import PARAMETERS, format_parameters
+from grosland.blueprints.cadastral_map import (
+    PARCELS_QUERY, PARCEL_TABLES, SEARCH_MODELS, SEARCH_TABLES, decode_cursor, encode_cursor, feature_collection,
+    search_statement
+)
+from grosland.blueprints.tiles import (
+    LAYERS, cache_layer, get_package, get_tile_cache, layer_role, local_tiles, tile_params, tile_query
+)
+from grosland.models import Users, geometry_column
+from grosland.responses import COMPRESSIBLE_MIMETYPES
+from itsdangerous import BadSignature
+from sqlalchemy import select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+from werkzeug.sansio.request import Request
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import zlib
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+
+logger = logging.getLogger(__name__)
+
+
+#   Response -----------------------------------------------------------------------------------------------------------
+class AsyncResponse:
+    """
+        Response of an async view. The body is bytes or an async generator of str chunks.
+    """
+    def __init__(self, body=b"", status: int = 200, mimetype: str = None):
+        self.body = body
+        self.status = status
+        self.headers = Headers()
+
+        if mimetype:
+            self.headers["Content-Type"] = mimetype
+
+    @property
+    def mimetype(self):
+        return self.headers.get("Content-Type")
+
+
+def build_request(scope: dict) -> Request:
+    """
+        Werkzeug request of the ASGI scope without a body, which the read endpoints do not have.
+    """
+    headers = Headers([(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]])
+    server, client = scope.get("server"), scope.get("client")
+
+    return Request(
+        scope["method"], scope.get("scheme", "http"), tuple(server) if server else None, "",
+        scope["path"], scope.get("query_string", b""), headers, client[0] if client else None
+    )
+
+
+async def encode_stream(chunks, encoding: str = None, level: int = 6):
+    compress = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if encoding == "gzip" else None
+
+    async for chunk in chunks:
+        data = compress.compress(chunk.encode()) if compress else chunk.encode()
+        if data:
+            yield data
+
+    if compress:
+        yield compress.flush()
+
+
+#   Application --------------------------------------------------------------------------------------------------------
+class AsyncReadApp:
+    """
+        ASGI application, which serves the read-only map endpoints (parcel lookup, search, tiles, parameters)
+        with SQLAlchemy's asyncio engine, so that requests waiting for PostgreSQL hold no worker thread.
+        URLs, session cookie, roles, queries, data versions and the tile cache are those of the Flask application.
+        Other requests are passed to the Flask application if asgiref is installed, otherwise they are answered
+        with 404 and must be routed to the WSGI server by the proxy.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.fallback = WsgiToAsgi(app) if WsgiToAsgi else None
+        self.views = {
+            "cadastral_map.get_parcel": ("cadastral_map", self.get_parcel),
+            "cadastral_map.get_parcels": ("cadastral_map", self.get_parcels),
+            "tiles.get_tile": (None, self.get_tile),
+            "api.parameters": (None, self.parameters),
+        }
+        self.engine = None
+        self.sessionmaker = None
+
+        with app.app_context():
+            self.tile_cache = get_tile_cache()
+            self.package = get_package()
+            self.local = local_tiles()
+
+    def connect(self):
+        """
+            Create the engine on the first request, asyncpg is imported only in the async mode.
+        """
+        if self.engine is not None:
+            return
+
+        url = self.app.config["ASYNC_DATABASE_URI"] or make_url(
+            self.app.config["SQLALCHEMY_DATABASE_URI"]
+        ).set(drivername="postgresql+asyncpg")
+
+        self.engine = create_async_engine(
+            url,
+            pool_size=self.app.config["ASYNC_POOL_SIZE"],
+            max_overflow=self.app.config["ASYNC_MAX_OVERFLOW"],
+            pool_pre_ping=True
+        )
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        if scope["type"] == "http" and scope["method"] == "GET":
+            request = build_request(scope)
+
+            try:
+                endpoint, values = self.app.url_map.bind(request.host or "localhost").match(request.path, "GET")
+            except HTTPException:
+                endpoint = None
+
+            if endpoint in self.views:
+                return await self.send(send, request, await self.dispatch(request, endpoint, values))
+
+        if self.fallback:
+            return await self.fallback(scope, receive, send)
+
+        if scope["type"] == "http":
+            await self.send(send, None, AsyncResponse(b"Not Found", 404, "text/plain"))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispatch(self, request: Request, endpoint: str, values: dict) -> AsyncResponse:
+        role, view = self.views[endpoint]
+        #   Tiles of the local mode are served without the users of the database
+        local = self.local and endpoint == "tiles.get_tile"
+
+        try:
+            user = None if local else await self.load_user(request)
+
+            if user is None and not local:
+                return AsyncResponse(b"Unauthorized", 401, "text/plain")
+
+            if role and role not in {item.name for item in user.roles}:
+                return AsyncResponse(b"Forbidden", 403, "text/plain")
+
+            return await view(request, user, **values)
+        except Exception:
+            logger.exception("Failed to serve %s", request.full_path)
+            return AsyncResponse(b"Internal Server Error", 500, "text/plain")
+
+    async def send(self, send, request, response: AsyncResponse):
+        """
+            Send the response, JSON is gzipped like by the compress hook of the Flask application.
+        """
+        body, encoding = response.body, None
+
+        if request is not None and response.status == 200 and response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.headers["Vary"] = "Accept-Encoding"
+            encoding = request.accept_encodings.best_match(["gzip"])
+
+            if isinstance(body, bytes) and len(body) < self.app.config["COMPRESS_MIN_SIZE"]:
+                encoding = None
+
+        if isinstance(body, bytes):
+            if encoding:
+                body = gzip.compress(body, self.app.config["COMPRESS_GZIP_LEVEL"])
+            response.headers["Content-Length"] = str(len(body))
+        else:
+            body = encode_stream(body, encoding, self.app.config["COMPRESS_GZIP_LEVEL"])
+
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+            if "ETag" in response.headers:
+                response.headers["ETag"] = response.headers["ETag"][:-1] + f'-{encoding}"'
+
+        await send({
+            "type": "http.response.start",
+            "status": response.status,
+            "headers": [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in response.headers],
+        })
+
+        if isinstance(body, bytes):
+            return await send({"type": "http.response.body", "body": body})
+
+        try:
+            async for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        except Exception:
+            logger.exception("Failed to stream %s", request.full_path)
+        await send({"type": "http.response.body", "body": b""})
+
+    #   Auth -----------------------------------------------------------------------------------------------------------
+    async def load_user(self, request: Request):
+        """
+            Active user of the Flask session cookie with the roles. Remember-me cookies are not read here,
+            the session is restored from them by the map page, which is served by the Flask application.
+        :return: Users or None
+        """
+        value = request.cookies.get(self.app.config["SESSION_COOKIE_NAME"])
+
+        if not value or self.serializer is None:
+            return None
+
+        try:
+            data = self.serializer.loads(value, max_age=int(self.app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+
+        if "_user_id" not in data:
+            return None
+
+        self.connect()
+
+        async with self.sessionmaker() as db:
+            return await db.scalar(
+                select(Users).options(selectinload(Users.roles))
+                .where(Users.fs_uniquifier == data["_user_id"], Users.active.is_(True))
+            )
+
+    #   Conditional GET ------------------------------------------------------------------------------------------------
+    def data_version(self, *tables: str) -> str:
+        with self.app.app_context():
+            return get_data_version(*tables)
+
+    async def etag(self, request: Request, *tables: str):
+        """
+            Etag of conditional() for public responses and the tag from If-None-Match, which matches it.
+        :return: (etag, matching tag or None)
+        """
+        version = await asyncio.to_thread(self.data_version, *tables)
+        etag = hashlib.sha1(f"{version}::{request.full_path}".encode()).hexdigest()
+
+        for value in request.if_none_match:
+            if value.partition("-")[0] == etag:
+                return etag, value
+
+        return etag, None
+
+    @staticmethod
+    def not_modified(value: str) -> AsyncResponse:
+        response = AsyncResponse(status=304)
+        response.headers["ETag"] = f'"{value}"'
+        response.headers["Cache-Control"] = "private, no-cache"
+
+        return response
+
+    @staticmethod
+    def tagged(response: AsyncResponse, etag: str) -> AsyncResponse:
+        response.headers["ETag"] = f'"{etag}"'
+        response.headers["Cache-Control"] = "private, no-cache"
+
+        return response
+
+    #   Views ----------------------------------------------------------------------------------------------------------
+    async def get_parcel(self, request: Request, user, cadnum: str) -> AsyncResponse:
+        etag, value = await self.etag(request, *PARCEL_TABLES)
+
+        if value:
+            return self.not_modified(value)
+
+        async with self.sessionmaker() as db:
+            parcels = dict((await db.execute(
+                text(PARCELS_QUERY.format(geometry=geometry_column(request.args.get("zoom", type=int)))),
+                {"cadnums": [cadnum], "precision": self.app.config["GEOJSON_PRECISION"]}
+            )).all())
+
+        if not parcels:
+            return AsyncResponse(b"Not Found", 404, "text/plain")
+
+        response = AsyncResponse(feature_collection(parcels.values()).encode(), mimetype="application/json")
+
+        return self.tagged(response, etag)
+
+    async def get_parcels(self, request: Request, user) -> AsyncResponse:
+        try:
+            limit = int(request.args.get("limit", self.app.config["SEARCH_LIMIT"]))
+            position = decode_cursor(request.args.get("cursor"))
+        except ValueError:
+            return AsyncResponse(b"Bad Request", 400, "text/plain")
+
+        if not 0 < limit <= self.app.config["SEARCH_MAX_LIMIT"]:
+            return AsyncResponse(b"Bad Request", 400, "text/plain")
+
+        etag, value = await self.etag(request, *SEARCH_TABLES)
+
+        if value:
+            return self.not_modified(value)
+
+        async def generate():
+            remaining = limit
+            cursor = None
+
+            yield "{"
+
+            async with self.sessionmaker() as db:
+                for index, model in enumerate(SEARCH_MODELS):
+                    yield ("" if index == 0 else ", ") + json.dumps(model.__name__) + ": ["
+
+                    #   Layers before the cursor are already sent
+                    if cursor or (position and SEARCH_MODELS.index(position[0]) > index):
+                        yield "]"
+                        continue
+
+                    result = await db.stream_scalars(search_statement(model, request.args, position, remaining + 1))
+
+                    last, count = "", 0
+                    async for cadnum in result:
+                        if count == remaining:
+                            cursor = encode_cursor(model, last)
+                            break
+
+                        yield ("" if count == 0 else ", ") + json.dumps(cadnum)
+                        last, count = cadnum, count + 1
+
+                    await result.close()
+                    remaining -= count
+
+                    yield "]"
+
+            yield ", \"cursor\": " + json.dumps(cursor) + "}"
+
+        return self.tagged(AsyncResponse(generate(), mimetype="application/json"), etag)
+
+    async def get_tile(self, request: Request, user, layer: str, z: int, x: int, y: int) -> AsyncResponse:
+        if (
+            layer not in LAYERS
+            or not self.app.config["TILES_MIN_ZOOM"] <= z <= self.app.config["TILES_MAX_ZOOM"]
+            or not (0 <= x < 2 ** z and 0 <= y < 2 ** z)
+        ):
+            return AsyncResponse(b"Not Found", 404, "text/plain")
+
+        if not self.local and layer_role(layer) not in {item.name for item in user.roles}:
+            return AsyncResponse(b"Forbidden", 403, "text/plain")
+
+        if self.package is not None:
+            tile = await asyncio.to_thread(self.package.get_layer, layer, z, x, y)
+
+            if tile is None:
+                return AsyncResponse(b"Not Found", 404, "text/plain")
+
+            return AsyncResponse(tile, mimetype="application/vnd.mapbox-vector-tile")
+
+        version = await asyncio.to_thread(self.data_version, layer)
+        key = cache_layer(layer, user.email)
+        tile = await asyncio.to_thread(self.tile_cache.get, key, version, z, x, y)
+
+        if tile is None:
+            async with self.sessionmaker() as db:
+                tile = await db.scalar(text(tile_query(layer, z)), tile_params(layer, z, x, y, user.email))
+
+            tile = bytes(tile) if tile else b""
+            await asyncio.to_thread(self.tile_cache.set, key, version, z, x, y, tile)
+
+        return AsyncResponse(tile, mimetype="application/vnd.mapbox-vector-tile")
+
+    async def parameters(self, request: Request, user) -> AsyncResponse:
+        tables = [model.__tablename__ for model in PARAMETERS]
+        etag, value = await self.etag(request, *tables)
+
+        if value:
+            return self.not_modified(value)
+
+        result = {}
+
+        async with self.sessionmaker() as db:
+            for model in PARAMETERS:
+                result[model.__tablename__] = format_parameters(model, (await db.scalars(select(model))).all())
+
+        return self.tagged(AsyncResponse(self.app.json.dumps(result).encode(), mimetype="application/json"), etag)
+
+
+def create_asgi_app(config=Config) -> AsyncReadApp:
+    """
+        Factory of the async serving mode, e.g. "uvicorn --factory grosland.asgi:create_asgi_app".
+    """
+    return AsyncReadApp(create_app(config))
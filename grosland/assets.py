@@ -0,0 +1,240 @@
+from flask import current_app, request, send_from_directory
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from rjsmin import jsmin
+except ImportError:
+    jsmin = None
+
+try:
+    from rcssmin import cssmin
+except ImportError:
+    cssmin = None
+
+
+#   Bundles ------------------------------------------------------------------------------------------------------------
+#   Files of every page relative to the static folder, in the order of loading
+BUNDLES = {
+    "base": {
+        "css": ["bootstrap/bootstrap.min.css"],
+        "js": ["bootstrap/bootstrap.bundle.min.js"],
+    },
+    "cadastral_map": {
+        "css": [
+            "leaflet/leaflet.css",
+            "locate/leaflet.locate.min.css",
+            "draw/leaflet.draw.css",
+            "panel-layers/leaflet.panel-layers.css",
+        ],
+        "js": [
+            "leaflet/leaflet.js",
+            "jquery/jquery.3.7.1.min.js",
+            "jquery/jquery.maskedinput.min.js",
+            "vectorgrid/leaflet.vectorgrid.mins.js",
+            "restoreview/leaflet.restoreview.js",
+            "easyprint/leaflet.easyprint.js",
+            "locate/leaflet.locate.min.js",
+            "draw/leaflet.draw.js",
+            "panel-layers/leaflet.panel-layers.js",
+            "grosland/grosland.leaflet.cadastral_map.js",
+            "grosland/grosland.jquery.maskedinput.cadnum.js",
+        ],
+    },
+    "ascm_map": {
+        "css": [
+            "leaflet/leaflet.css",
+            "locate/leaflet.locate.min.css",
+        ],
+        "js": [
+            "leaflet/leaflet.js",
+            "vectorgrid/leaflet.vectorgrid.mins.js",
+            "restoreview/leaflet.restoreview.js",
+            "locate/leaflet.locate.min.js",
+            "grosland/grosland.leaflet.ascm_map.js",
+        ],
+    },
+}
+
+BUNDLES_DIR = "dist"
+MANIFEST = "manifest.json"
+
+#   Files of the last builds, which are kept for the pages rendered by workers that have not restarted yet
+BUILDS = "builds.json"
+KEEP_BUILDS = 3
+
+SOURCE_MAP = re.compile(r"^\s*(//|/\*)[#@] sourceMappingURL=.*$", re.MULTILINE)
+CSS_URL = re.compile(r"""url\(\s*(['"]?)(?!data:|[a-z]+://|/|#)([^'")]+)\1\s*\)""")
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+
+
+#   Build --------------------------------------------------------------------------------------------------------------
+def read_js(static_folder: str, path: str, static_url_path: str) -> str:
+    """
+        Minified file content without its source map, which does not match the bundle.
+    """
+    with open(os.path.join(static_folder, path), encoding="utf-8") as file:
+        content = SOURCE_MAP.sub("", file.read())
+
+    #   The semicolon protects files without a trailing one
+    return (jsmin(content) if jsmin else content.strip()) + "\n;"
+
+
+def read_css(static_folder: str, path: str, static_url_path: str) -> str:
+    """
+        Minified file content with relative urls resolved against the static url of the file.
+    """
+    with open(os.path.join(static_folder, path), encoding="utf-8") as file:
+        content = SOURCE_MAP.sub("", file.read())
+
+    #   Relative urls point to the directory of the source file, the bundle is in another one
+    directory = posixpath.join(static_url_path, posixpath.dirname(path))
+    content = CSS_URL.sub(
+        lambda match: f"url({match.group(1)}{posixpath.normpath(posixpath.join(directory, match.group(2)))}"
+                      f"{match.group(1)})",
+        content
+    )
+
+    if cssmin:
+        return cssmin(content)
+
+    content = CSS_COMMENT.sub("", content)
+    return "\n".join(line.strip() for line in content.splitlines() if line.strip())
+
+
+READERS = {"js": read_js, "css": read_css}
+
+
+def write_bundle(directory: str, name: str, kind: str, content: bytes) -> str:
+    """
+        Write the content-hashed bundle and its precompressed siblings.
+    :return: File name, e.g. "cadastral_map.1a2b3c4d5e6f.js"
+    """
+    filename = f"{name}.{hashlib.sha256(content).hexdigest()[:12]}.{kind}"
+    path = os.path.join(directory, filename)
+
+    variants = {path: content, f"{path}.gz": gzip.compress(content, 9, mtime=0)}
+    if brotli:
+        variants[f"{path}.br"] = brotli.compress(content, quality=11)
+
+    for variant, data in variants.items():
+        with open(f"{variant}.tmp", "wb") as file:
+            file.write(data)
+        os.replace(f"{variant}.tmp", variant)
+
+    return filename
+
+
+def build_bundles(static_folder: str, static_url_path: str = "/static") -> dict:
+    """
+        Concatenate and minify the files of every page into content-hashed bundles in static/dist
+        with .gz and .br siblings. Bundles of the last KEEP_BUILDS builds are kept
+        during a rolling restart, older ones are removed.
+    :return: Manifest {"cadastral_map": {"js": "cadastral_map.1a2b3c4d5e6f.js", "css": ...}, ...}
+    :raise RuntimeError: The minifiers or brotli are not installed
+    """
+    missing = [name for name, module in (("rjsmin", jsmin), ("rcssmin", cssmin), ("Brotli", brotli)) if not module]
+    if missing:
+        raise RuntimeError(f"{', '.join(missing)} not installed, run pip install -r requirements.txt")
+
+    directory = os.path.join(static_folder, BUNDLES_DIR)
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+
+    for name, kinds in BUNDLES.items():
+        manifest[name] = {}
+
+        for kind, paths in kinds.items():
+            content = "\n".join(READERS[kind](static_folder, path, static_url_path) for path in paths)
+            manifest[name][kind] = write_bundle(directory, name, kind, content.encode())
+
+    with open(os.path.join(directory, f"{MANIFEST}.tmp"), "w") as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(os.path.join(directory, f"{MANIFEST}.tmp"), os.path.join(directory, MANIFEST))
+
+    try:
+        with open(os.path.join(directory, BUILDS)) as file:
+            builds = json.load(file)
+    except (OSError, ValueError):
+        builds = []
+
+    current = sorted(filename for kinds in manifest.values() for filename in kinds.values())
+    builds = ([current] + [build for build in builds if build != current])[:KEEP_BUILDS]
+
+    with open(os.path.join(directory, f"{BUILDS}.tmp"), "w") as file:
+        json.dump(builds, file, indent=4)
+    os.replace(os.path.join(directory, f"{BUILDS}.tmp"), os.path.join(directory, BUILDS))
+
+    kept = {filename for build in builds for filename in build}
+    for filename in os.listdir(directory):
+        if filename not in (MANIFEST, BUILDS) and filename.removesuffix(".gz").removesuffix(".br") not in kept:
+            os.remove(os.path.join(directory, filename))
+
+    return manifest
+
+
+#   Assets -------------------------------------------------------------------------------------------------------------
+class Assets:
+    """
+        Template helper assets(page, kind) with the urls of the page files and the route of the bundles.
+        Without a built manifest (e.g. in development) the source files are referenced one by one.
+    """
+    def __init__(self):
+        self.manifest = None
+        self.directory = None
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.static_folder, BUNDLES_DIR)
+
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as file:
+                self.manifest = json.load(file)
+        except (OSError, ValueError):
+            self.manifest = None
+
+        app.add_url_rule(f"{app.static_url_path}/{BUNDLES_DIR}/<path:filename>", "bundle", self.send_bundle)
+        app.add_template_global(self.urls, "assets")
+
+    def urls(self, page: str, kind: str) -> list:
+        """
+            Urls of the page files, e.g. assets("cadastral_map", "js").
+        """
+        static_url_path = current_app.static_url_path
+
+        if self.manifest and kind in self.manifest.get(page, {}):
+            return [f"{static_url_path}/{BUNDLES_DIR}/{self.manifest[page][kind]}"]
+
+        return [f"{static_url_path}/{path}" for path in BUNDLES[page].get(kind, [])]
+
+    def send_bundle(self, filename: str):
+        """
+            Precompressed variant of the bundle accepted by the client. Bundle names change with their content,
+            so they are cached forever.
+        """
+        encodings = {
+            encoding: suffix
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz"))
+            if os.path.isfile(os.path.join(self.directory, filename + suffix))
+        }
+        encoding = request.accept_encodings.best_match(list(encodings))
+
+        if encoding:
+            response = send_from_directory(self.directory, filename + encodings[encoding], max_age=31536000)
+            response.headers["Content-Encoding"] = encoding
+            response.mimetype = "text/css" if filename.endswith(".css") else "text/javascript"
+        else:
+            response = send_from_directory(self.directory, filename, max_age=31536000)
+
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        response.vary.add("Accept-Encoding")
+
+        return response
@@ -1,3 +1,4 @@
 from .api import api
 from .cadastral_map import cadastral_map
 from .ascm_map import ascm_map
+from .tiles import tiles
@@ -1,10 +1,35 @@
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, abort, jsonify, request, Response
 from flask_security import login_required, current_user
-from grosland.app import cache, session
-from grosland.models import Cadastre, Archive, Land, Ownership, Purpose, History
+from grosland.app import cache, history_writer, read_from_replica, session, versioned_key
+from grosland.models import Cadastre, Archive, Land, Ownership, Purpose, History, PARCEL_STATISTICS
+from grosland.responses import compress, conditional
+from sqlalchemy import text
 
 
 api = Blueprint('api', __name__, url_prefix="/api")
+api.before_request(read_from_replica)
+api.after_request(compress)
+
+STATISTICS_COLUMNS = ("council_code", "village_code", "ownership_code", "purpose_code")
+
+PARAMETERS = (Ownership, Purpose)
+
+
+#   Functions   --------------------------------------------------------------------------------------------------------
+def format_parameters(model, items) -> dict:
+    """
+        Parameters of the map filters keyed by their client-side names.
+    :param model: Ownership or Purpose
+    :param items: [Ownership, ...]
+    :return: {"100OwnershipCustomParameter": {"code": "100", "desc": "приватна"}, ...}
+    """
+    return {
+        item.code.replace(".", "") + model.__tablename__.title() + "CustomParameter": {
+            "code": item.code,
+            "desc": item.desc
+        }
+        for item in items
+    }
 
 
 #   Main page of API   -------------------------------------------------------------------------------------------------
@@ -22,26 +47,57 @@ def index():
 #   GET data    --------------------------------------------------------------------------------------------------------
 @api.route("/user", methods=["GET"])
 @login_required
+@conditional()
 def user():
     return jsonify({"email": current_user.email})
 
 
 @api.route("/parameters", methods=["GET"])
 @login_required
-@cache.cached()
+@conditional(Ownership.__tablename__, Purpose.__tablename__)
+@cache.cached(key_prefix=versioned_key(Ownership.__tablename__, Purpose.__tablename__))
 def parameters():
-    result = {}
+    return jsonify({model.__tablename__: format_parameters(model, session.query(model).all()) for model in PARAMETERS})
+
+
+@api.route("/statistics", methods=["GET"])
+@login_required
+@conditional(PARCEL_STATISTICS)
+@cache.cached(key_prefix=versioned_key(PARCEL_STATISTICS))
+def statistics():
+    """
+        Number and area of the current plots from the materialized statistics.
+        Filters are exact codes, e.g. /statistics?council_code=5121680800&ownership_code=300,
+        group_by lists the columns of the result (all by default), e.g. group_by=purpose_code.
+    :return: {
+        "items": [{"purpose_code": "01.01", "count": 10, "area": 25.1}, ...],
+        "total": {"count": 10, "area": 25.1}
+    }
+    """
+    group_by = [column for column in request.args.get("group_by", ",".join(STATISTICS_COLUMNS)).split(",") if column]
+
+    if any(column not in STATISTICS_COLUMNS for column in group_by):
+        abort(400)
+
+    filters = {column: request.args[column] for column in STATISTICS_COLUMNS if column in request.args}
+    where = " AND ".join(f"{column} = :{column}" for column in filters) or "TRUE"
+    columns = "".join(f"{column}, " for column in group_by)
 
-    for model in (Ownership, Purpose):
-        result[model.__tablename__] = {}
+    rows = session.execute(text(
+        f"SELECT {columns}sum(count)::int AS count, coalesce(sum(area), 0)::float AS area "
+        f"FROM {PARCEL_STATISTICS} WHERE {where} "
+        + (f"GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else "")
+    ), filters).mappings().all()
 
-        for item in session.query(model).all():
-            result[item.__tablename__][item.code.replace(".", "") + item.__tablename__.title() + "CustomParameter"] = {
-                "code": item.code,
-                "desc": item.desc
-            }
+    items = [dict(row) for row in rows if row["count"]]
 
-    return jsonify(result)
+    return jsonify({
+        "items": items,
+        "total": {
+            "count": sum(item["count"] for item in items),
+            "area": round(sum(item["area"] for item in items), 4),
+        }
+    })
 
 
 #   CREATE data --------------------------------------------------------------------------------------------------------
@@ -49,8 +105,12 @@ def parameters():
 @login_required
 def history():
     """
-        Saving search history.
+        Saving search history. Rows are written to the database in batches by the background writer.
     """
-    session.add(History(message=request.get_data().decode()))
-    session.commit()
+    history_writer.put(
+        user_id=current_user.id,
+        #   The column is not nullable, requests without the header of the proxy fall back to the peer address
+        user_ip=(request.headers.get("X-Real-IP") or request.remote_addr or "")[:History.user_ip.type.length],
+        message=request.get_data().decode()[:History.message.type.length]
+    )
     return Response(status=200)
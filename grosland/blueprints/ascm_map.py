@@ -1,7 +1,80 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, abort, current_app, request, Response
 from flask_security import login_required, roles_required
+from grosland.app import cache, read_from_replica, session, versioned_key
+from grosland.blueprints.cadastral_map import feature_collection
+from grosland.models import ASCM
+from grosland.responses import compress, conditional
+from sqlalchemy import text
+import math
+
 
 ascm_map = Blueprint("ascm_map", __name__, url_prefix="/ascm_map")
+ascm_map.before_request(read_from_replica)
+ascm_map.after_request(compress)
+
+ASCM_TABLES = [ASCM.__tablename__]
+
+#   Width of a tile pixel in Web Mercator meters at zoom 0
+PIXEL_SIZE = 2 * math.pi * 6378137 / 256
+
+#   Points are snapped to a grid of Web Mercator cells, every cell with markers becomes one cluster
+CLUSTERS_QUERY = f"""
+    SELECT json_build_object(
+        'type', 'Feature',
+        'properties', json_build_object(
+            'count', count(*),
+            'color', mode() WITHIN GROUP (ORDER BY t.color),
+            'code', CASE WHEN count(*) = 1 THEN min(t.code) END
+        ),
+        'geometry', ST_AsGeoJSON(ST_Transform(ST_Centroid(ST_Collect(t.point)), 4326), :precision)::json
+    )::text
+    FROM (
+        SELECT code, color, ST_Transform(geometry, 3857) AS point
+        FROM {ASCM.__tablename__}
+        WHERE geometry && ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)
+    ) t
+    GROUP BY ST_SnapToGrid(t.point, :cell)
+"""
+
+POINTS_QUERY = f"""
+    SELECT json_build_object(
+        'type', 'Feature',
+        'properties', json_build_object(
+            'count', 1,
+            'color', t.color,
+            'code', t.code
+        ),
+        'geometry', ST_AsGeoJSON(t.geometry, :precision)::json
+    )::text
+    FROM {ASCM.__tablename__} t
+    WHERE t.geometry && ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)
+    ORDER BY t.code
+    LIMIT :limit
+"""
+
+
+#   Functions   --------------------------------------------------------------------------------------------------------
+def find_clusters(bbox: tuple, zoom: int) -> tuple:
+    """
+        Markers in the bounding box, grouped into clusters of ASCM_CLUSTER_SIZE pixels below ASCM_CLUSTER_MAX_ZOOM.
+        Clusters have the number of markers, their centroid and the most frequent color.
+    :param bbox: (xmin, ymin, xmax, ymax)
+    :return: (['{"type": "Feature", ...}', ...], clustered)
+    """
+    params = {
+        "xmin": bbox[0], "ymin": bbox[1], "xmax": bbox[2], "ymax": bbox[3],
+        "precision": current_app.config["GEOJSON_PRECISION"],
+    }
+
+    if zoom > current_app.config["ASCM_CLUSTER_MAX_ZOOM"]:
+        features = session.execute(
+            text(POINTS_QUERY), {**params, "limit": current_app.config["SPATIAL_MAX_LIMIT"]}
+        ).scalars().all()
+        return features, False
+
+    cell = PIXEL_SIZE / 2 ** zoom * current_app.config["ASCM_CLUSTER_SIZE"]
+
+    return session.execute(text(CLUSTERS_QUERY), {**params, "cell": cell}).scalars().all(), True
 
 
 #   View ASCM map  -----------------------------------------------------------------------------------------------------
@@ -15,3 +88,27 @@ def index():
     return render_template("ascm_map.html")
 
 
+#   GET Clusters   -----------------------------------------------------------------------------------------------------
+@ascm_map.route("/clusters", methods=["GET"])
+@login_required
+@roles_required("ascm_map")
+@conditional(*ASCM_TABLES)
+@cache.cached(key_prefix=versioned_key(*ASCM_TABLES))
+def get_clusters():
+    """
+        Clusters of markers in the bounding box for an overview at low zoom, individual markers at high zoom,
+        e.g. /ascm_map/clusters?bbox=-114.3,50.9,-113.8,51.2&zoom=10
+    :return: FeatureCollection with "clustered" or Error "400 BAD REQUEST"
+    """
+    try:
+        bbox = tuple(float(value) for value in request.args["bbox"].split(","))
+        zoom = int(request.args["zoom"])
+    except (KeyError, ValueError):
+        abort(400)
+
+    if len(bbox) != 4 or not 0 <= zoom <= current_app.config["TILES_MAX_ZOOM"]:
+        abort(400)
+
+    features, clustered = find_clusters(bbox, zoom)
+
+    return Response(feature_collection(features, clustered=clustered), mimetype="application/json")
@@ -1,12 +1,274 @@
-from flask import Blueprint, render_template, abort, jsonify, request, Response
+from flask import Blueprint, render_template, abort, current_app, request, Response, stream_with_context
 from flask_security import login_required, roles_required, current_user
-from grosland.app import cache, session
-from grosland.models import Cadastre, Archive, Land, Ownership, Purpose
+from grosland.app import cache, read_from_replica, session, versioned_key
+from grosland.export import EXPORT_FORMATS, export_parcels
+from grosland.models import Cadastre, Archive, Land, Ownership, Purpose, geometry_column
+from grosland.responses import compress, conditional
+from grosland.validation import validate_geometries
 from geoalchemy2.shape import from_shape
+from shapely.errors import ShapelyError
 from shapely.geometry import shape
+import shapely
+from sqlalchemy import select, text
+import base64
+import json
+import operator
 
 
 cadastral_map = Blueprint("cadastral_map", __name__, url_prefix="/cadastral_map")
+cadastral_map.before_request(read_from_replica)
+cadastral_map.after_request(compress)
+
+PARCEL_COLUMNS = "id, cadnum, area, address, ownership_code, purpose_code, {geometry} AS geometry"
+
+PARCELS_QUERY = f"""
+    SELECT DISTINCT ON (parcel.cadnum)
+        parcel.cadnum,
+        json_build_object(
+            'type', 'Feature',
+            'properties', json_build_object(
+                'id', parcel.id,
+                'area', parcel.area::float,
+                'address', parcel.address,
+                'cadnum', parcel.cadnum,
+                'ownership', parcel.ownership_code || ' ' || {Ownership.__tablename__}."desc" || ' власність',
+                'purpose', parcel.purpose_code || ' ' || {Purpose.__tablename__}."desc"
+            ),
+            'geometry', ST_AsGeoJSON(parcel.geometry, :precision)::json
+        )::text
+    FROM (
+        SELECT {PARCEL_COLUMNS}, 0 AS priority FROM {Cadastre.__tablename__} WHERE cadnum = ANY(:cadnums)
+        UNION ALL
+        SELECT {PARCEL_COLUMNS}, 1 AS priority FROM {Archive.__tablename__} WHERE cadnum = ANY(:cadnums)
+    ) parcel
+    JOIN {Ownership.__tablename__} ON {Ownership.__tablename__}.code = parcel.ownership_code
+    JOIN {Purpose.__tablename__} ON {Purpose.__tablename__}.code = parcel.purpose_code
+    ORDER BY parcel.cadnum, parcel.priority
+"""
+
+
+PARCEL_TABLES = [model.__tablename__ for model in (Cadastre, Archive, Ownership, Purpose)]
+
+SEARCH_MODELS = [Cadastre, Archive]
+
+SEARCH_TABLES = [model.__tablename__ for model in SEARCH_MODELS]
+
+AREA_OPERATORS = {
+    "==": operator.eq,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+}
+
+
+SPATIAL_MODELS = {model.__tablename__: model for model in (Cadastre, Archive, Land)}
+
+SPATIAL_TABLES = list(SPATIAL_MODELS)
+
+SPATIAL_QUERY = """
+    SELECT json_build_object(
+        'type', 'Feature',
+        'properties', json_build_object(
+            'layer', :layer,
+            'id', t.id,
+            'cadnum', t.cadnum,
+            'area', t.area::float,
+            'address', t.address,
+            'ownership_code', t.ownership_code,
+            'purpose_code', t.purpose_code
+        ),
+        'geometry', ST_AsGeoJSON({geometry}, :precision)::json
+    )::text
+    FROM {table} t
+    WHERE ST_Intersects(t.geometry, {filter}) {owner}
+    ORDER BY t.cadnum
+    LIMIT :limit
+"""
+
+SPATIAL_FILTERS = {
+    "point": "ST_SetSRID(ST_MakePoint(:lng, :lat), 4326)",
+    "bbox": "ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 4326)",
+    "polygon": "ST_SetSRID(ST_GeomFromGeoJSON(:geojson), 4326)",
+}
+
+OVERLAPS_QUERY = f"""
+    SELECT json_build_object(
+        'type', 'Feature',
+        'properties', json_build_object(
+            'layer', '{Land.__tablename__}',
+            'id', l.id,
+            'cadnum', l.cadnum,
+            'area', l.area::float,
+            'overlaps', json_agg(json_build_object(
+                'cadnum', c.cadnum,
+                'area', round((ST_Area(ST_Intersection(l.geometry, c.geometry)::geography) / 10000)::numeric, 4)
+            ) ORDER BY c.cadnum)
+        ),
+        'geometry', ST_AsGeoJSON(l.geometry, :precision)::json
+    )::text
+    FROM {Land.__tablename__} l
+    JOIN {Cadastre.__tablename__} c ON ST_Intersects(l.geometry, c.geometry) AND NOT ST_Touches(l.geometry, c.geometry)
+    WHERE l.address = :email
+    GROUP BY l.id
+    ORDER BY l.id
+    LIMIT :limit
+"""
+
+
+#   Functions   --------------------------------------------------------------------------------------------------------
+def find_parcels(cadnums: list, zoom: int = None) -> dict:
+    """
+        Search for land areas by cadastral and archive layers, the cadastral layer takes precedence.
+        Features are rendered by PostGIS, so they are returned as ready geojson strings.
+    :param cadnums: ["5121680800:01:001:0025", ...]
+    :param zoom: Map zoom to return the generalized geometry or None for the full resolution.
+    :return: {"5121680800:01:001:0025": '{"type": "Feature", ...}', ...}
+    """
+    return dict(session.execute(
+        text(PARCELS_QUERY.format(geometry=geometry_column(zoom))),
+        {"cadnums": list(cadnums), "precision": current_app.config["GEOJSON_PRECISION"]}
+    ).all())
+
+
+def feature_collection(features, **members) -> str:
+    """
+        Assemble a FeatureCollection from ready geojson strings of features without decoding them.
+    :param features: ['{"type": "Feature", ...}', ...]
+    :param members: Additional members of the FeatureCollection.
+    :return: Geojson string
+    """
+    result = '{"type": "FeatureCollection", "features": [' + ", ".join(features) + "]"
+
+    for key, value in members.items():
+        result += ", " + json.dumps(key) + ": " + json.dumps(value)
+
+    return result + "}"
+
+
+def search_filters(model, args) -> list:
+    """
+        Build search filters of the model from the request arguments.
+        Text filters are substring matches served by pg_trgm indexes.
+    :param model: Cadastre or Archive
+    :param args: Request arguments.
+    :return: [BinaryExpression, ...]
+    """
+    query_filters = []
+
+    for item in ["cadnum", "area", "ownership_code", "purpose_code", "address"]:
+        value = args.get(item)
+
+        if value:
+            if item == "area":
+                compare = AREA_OPERATORS.get(value[:2])
+                try:
+                    arg_area = float(value[2:].replace(",", "."))
+                except ValueError:
+                    continue
+
+                if compare and arg_area >= 0:
+                    query_filters.append(compare(model.area, arg_area))
+            else:
+                pattern = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                query_filters.append(getattr(model, item).ilike(f"%{pattern}%", escape="\\"))
+
+    return query_filters
+
+
+def search_statement(model, args, position, limit: int):
+    """
+        Cadnums of the model matching the search filters after the cursor position, in the order of pages.
+    :param position: (model, cadnum) from decode_cursor or None
+    :return: Select
+    """
+    statement = select(model.cadnum).filter(*search_filters(model, args))
+
+    if position and position[0] is model:
+        statement = statement.filter(model.cadnum > position[1])
+
+    return statement.order_by(model.cadnum.asc()).limit(limit).execution_options(yield_per=1000)
+
+
+def encode_cursor(model, cadnum: str) -> str:
+    """
+        Opaque keyset cursor pointing after the cadnum in the layer of the model.
+    """
+    return base64.urlsafe_b64encode(json.dumps({"layer": model.__name__, "cadnum": cadnum}).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """
+        Decode the keyset cursor.
+    :return: (model, cadnum) or None
+    :raise ValueError: Invalid cursor
+    """
+    if not cursor:
+        return None
+
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        model = {model.__name__: model for model in SEARCH_MODELS}[position["layer"]]
+        return model, str(position["cadnum"])
+    except (KeyError, TypeError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def spatial_limit() -> int:
+    """
+        Limit of features from the request arguments.
+    :raise ValueError: Invalid limit
+    """
+    limit = int(request.args.get("limit", current_app.config["SPATIAL_LIMIT"]))
+
+    if not 0 < limit <= current_app.config["SPATIAL_MAX_LIMIT"]:
+        raise ValueError("Invalid limit")
+
+    return limit
+
+
+def find_intersecting(spatial_filter: str, params: dict, layers: list, limit: int, zoom=None) -> list:
+    """
+        Features of the layers intersecting the filter geometry. Queries are served by GiST indexes.
+    :param spatial_filter: Key of SPATIAL_FILTERS.
+    :param params: Parameters of the filter geometry.
+    :param layers: ["cadastre", "archive", "land"]
+    :param limit: Maximum number of features of every layer.
+    :param zoom: Map zoom to return the generalized geometry or None for the full resolution.
+    :return: ['{"type": "Feature", ...}', ...]
+    """
+    features = []
+
+    for layer in layers:
+        query = SPATIAL_QUERY.format(
+            table=SPATIAL_MODELS[layer].__tablename__,
+            geometry=f"t.{geometry_column(zoom)}",
+            filter=SPATIAL_FILTERS[spatial_filter],
+            #   User polygons are visible only to their author
+            owner="AND t.address = :email" if SPATIAL_MODELS[layer] is Land else ""
+        )
+
+        features.extend(session.execute(text(query), {
+            **params,
+            "layer": layer,
+            "limit": limit,
+            "precision": current_app.config["GEOJSON_PRECISION"],
+            "email": current_user.email,
+        }).scalars())
+
+    return features
+
+
+def spatial_layers(value: str) -> list:
+    """
+        Layers from the request argument, e.g. "cadastre,archive".
+    :raise ValueError: Unknown layer
+    """
+    layers = [layer for layer in (value or ",".join(SPATIAL_MODELS)).split(",") if layer]
+
+    if not layers or any(layer not in SPATIAL_MODELS for layer in layers):
+        raise ValueError("Unknown layer")
+
+    return layers
 
 
 #   View Cadastral map  ------------------------------------------------------------------------------------------------
@@ -24,58 +286,254 @@ def index():
 @cadastral_map.route("/parcels/<cadnum>",  methods=["GET"])
 @login_required
 @roles_required("cadastral_map")
-@cache.cached()
+@conditional(*PARCEL_TABLES)
+@cache.cached(key_prefix=versioned_key(*PARCEL_TABLES))
 def get_parcel(cadnum):
     """
          Search for land area by cadastral and archive layers.
     :return: Information about land area in geojson format or Error "404 PAGE NOT FOUND"
     """
-    for model in [Cadastre, Archive]:
-        parcel = session.query(model).filter_by(cadnum=cadnum).first()
+    parcels = find_parcels([cadnum], request.args.get("zoom", type=int))
+
+    if not parcels:
+        abort(404)
+
+    return Response(feature_collection(parcels.values()), mimetype="application/json")
+
+
+@cadastral_map.route("/parcels/batch", methods=["POST"])
+@login_required
+@roles_required("cadastral_map")
+def get_parcels_batch():
+    """
+        Search for many land areas by cadastral and archive layers with one query.
+        Accepts {"cadnums": ["5121680800:01:001:0025", ...], "zoom": 10}, zoom is optional.
+    :return: {
+        "type": "FeatureCollection",
+        "features": [...],
+        "not_found": ["5121680800:01:001:9999", ...]
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    cadnums = data.get("cadnums") if isinstance(data, dict) else None
+
+    if not isinstance(cadnums, list) or not all(isinstance(cadnum, str) for cadnum in cadnums):
+        abort(400)
+
+    zoom = data.get("zoom")
+
+    if zoom is not None and not isinstance(zoom, int):
+        abort(400)
 
-        if parcel:
-            return jsonify(parcel.wkb_to_geojson())
+    cadnums = list(dict.fromkeys(cadnum.strip() for cadnum in cadnums if cadnum.strip()))
 
-    return abort(404)
+    if len(cadnums) > current_app.config["PARCELS_BATCH_LIMIT"]:
+        abort(413)
+
+    parcels = find_parcels(cadnums, zoom) if cadnums else {}
+
+    return Response(
+        feature_collection(
+            (parcels[cadnum] for cadnum in cadnums if cadnum in parcels),
+            not_found=[cadnum for cadnum in cadnums if cadnum not in parcels]
+        ),
+        mimetype="application/json"
+    )
 
 
 @cadastral_map.route("/parcels/", methods=["GET"])
 @login_required
 @roles_required("cadastral_map")
+@conditional(*SEARCH_TABLES)
 def get_parcels():
     """
-        Get a list of all generated land areas in the database.
+        Get a list of generated land areas in the database.
+        Results are paginated by "limit" and the opaque "cursor" returned with the previous page
+        and streamed to the client row by row.
     :return: {
+        "Cadastre": ["5121680800:01:001:0025", "5121680800:01:001:0026", ...],
         "Archive":  ["5121680800:01:001:0981", "5121680800:01:001:1000", ...],
-        "Cadastre": ["5121680800:01:001:0025", "5121680800:01:001:0026", ...]
+        "cursor": "eyJsYXllciI6ICJBcmNoaXZlIiwgImNhZG51bSI6ICI1MTIxNjgwODAwOjAxOjAwMToxMDAwIn0=" or null
     }
     """
-    parcels = {"Archive": [], "Cadastre": []}
+    try:
+        limit = int(request.args.get("limit", current_app.config["SEARCH_LIMIT"]))
+        position = decode_cursor(request.args.get("cursor"))
+    except ValueError:
+        abort(400)
+
+    if not 0 < limit <= current_app.config["SEARCH_MAX_LIMIT"]:
+        abort(400)
+
+    def generate():
+        remaining = limit
+        cursor = None
+
+        yield "{"
+
+        for index, model in enumerate(SEARCH_MODELS):
+            yield ("" if index == 0 else ", ") + json.dumps(model.__name__) + ": ["
+
+            #   Layers before the cursor are already sent
+            if cursor or (position and SEARCH_MODELS.index(position[0]) > index):
+                yield "]"
+                continue
+
+            last, count = "", 0
+            for cadnum in session.execute(search_statement(model, request.args, position, remaining + 1)).scalars():
+                if count == remaining:
+                    cursor = encode_cursor(model, last)
+                    break
+
+                yield ("" if count == 0 else ", ") + json.dumps(cadnum)
+                last, count = cadnum, count + 1
+
+            remaining -= count
+
+            yield "]"
+
+        yield ", \"cursor\": " + json.dumps(cursor) + "}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+#   Spatial queries ----------------------------------------------------------------------------------------------------
+@cadastral_map.route("/parcels/at", methods=["GET"])
+@login_required
+@roles_required("cadastral_map")
+@conditional(*SPATIAL_TABLES, private=True)
+def get_parcels_at():
+    """
+        Land areas under the point, e.g. /parcels/at?lat=47.07&lng=29.9&layer=cadastre,archive
+    :return: FeatureCollection
+    """
+    try:
+        params = {"lat": float(request.args["lat"]), "lng": float(request.args["lng"])}
+        layers = spatial_layers(request.args.get("layer"))
+        limit = spatial_limit()
+    except (KeyError, ValueError):
+        abort(400)
+
+    return Response(
+        feature_collection(find_intersecting("point", params, layers, limit, request.args.get("zoom", type=int))),
+        mimetype="application/json"
+    )
+
+
+@cadastral_map.route("/parcels/bbox", methods=["GET"])
+@login_required
+@roles_required("cadastral_map")
+@conditional(*SPATIAL_TABLES, private=True)
+def get_parcels_bbox():
+    """
+        Land areas intersecting the bounding box, e.g. /parcels/bbox?bbox=29.8,47.0,29.9,47.1&zoom=12
+    :return: FeatureCollection
+    """
+    try:
+        xmin, ymin, xmax, ymax = (float(value) for value in request.args["bbox"].split(","))
+        layers = spatial_layers(request.args.get("layer"))
+        limit = spatial_limit()
+    except (KeyError, ValueError):
+        abort(400)
+
+    params = {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax}
+
+    return Response(
+        feature_collection(find_intersecting("bbox", params, layers, limit, request.args.get("zoom", type=int))),
+        mimetype="application/json"
+    )
+
+
+@cadastral_map.route("/parcels/intersects", methods=["POST"])
+@login_required
+@roles_required("cadastral_map")
+def get_parcels_intersects():
+    """
+        Land areas intersecting a polygon drawn on the map.
+        Accepts {"geojson": Leaflet layer.toGeoJSON() feature or geometry, "layer": "cadastre", "zoom": 15}.
+        Self-intersecting polygons are repaired like in add_polygon before the query.
+    :return: FeatureCollection or Error "400 BAD REQUEST" for a malformed polygon
+    """
+    data = request.get_json(silent=True)
+
+    try:
+        geometry = data["geojson"]
+        geometry = geometry.get("geometry", geometry) if isinstance(geometry, dict) else json.loads(geometry)
+        geometry = geometry.get("geometry", geometry)
 
-    for model in [Cadastre, Archive]:
-        query_filters = []
+        if geometry["type"] not in ("Polygon", "MultiPolygon"):
+            raise ValueError("Polygon expected")
 
-        for item in ["cadnum", "area", "ownership_code", "purpose_code", "address"]:
-            value = request.args.get(item)
+        polygon = shape(geometry)
+        layers = spatial_layers(data.get("layer"))
+        limit = spatial_limit()
+        zoom = int(data["zoom"]) if data.get("zoom") is not None else None
+    except (KeyError, TypeError, AttributeError, ValueError, ShapelyError):
+        abort(400)
 
-            if value:
-                if item == "area":
-                    operator = value[:2]
-                    try:
-                        arg_area = float(value[2:].replace(",", "."))
-                    except ValueError:
-                        continue
+    result = validate_geometries([polygon])
 
-                    if operator in ["==", ">=", "<=", "!="] and arg_area >= 0:
-                        query_filters.append(eval(f"model.{item} {operator} {arg_area}"))
-                else:
-                    query_filters.append(eval(f"model.{item}.ilike('%{value}%')"))
+    if result["status"][0] == "rejected":
+        abort(400)
 
-        parcels[model.__name__].extend(
-            item.cadnum for item in session.query(model).filter(*query_filters).order_by(model.cadnum.asc()).all()
+    params = {"geojson": shapely.to_geojson(result["geometry"][0])}
+
+    return Response(
+        feature_collection(find_intersecting("polygon", params, layers, limit, zoom)),
+        mimetype="application/json"
+    )
+
+
+@cadastral_map.route("/land/overlaps", methods=["GET"])
+@login_required
+@roles_required("cadastral_map")
+@conditional(Land.__tablename__, Cadastre.__tablename__, private=True)
+def get_land_overlaps():
+    """
+        User's polygons overlapping the cadastral layer with the overlapped plots and overlap area in hectares.
+    :return: FeatureCollection
+    """
+    try:
+        limit = spatial_limit()
+    except ValueError:
+        abort(400)
+
+    features = session.execute(text(OVERLAPS_QUERY), {
+        "email": current_user.email,
+        "limit": limit,
+        "precision": current_app.config["GEOJSON_PRECISION"],
+    }).scalars()
+
+    return Response(feature_collection(features), mimetype="application/json")
+
+
+#   Export  ------------------------------------------------------------------------------------------------------------
+@cadastral_map.route("/export/<koatuu>", methods=["GET"])
+@login_required
+@roles_required("cadastral_map")
+def export(koatuu):
+    """
+        Plots of the KOATUU as a file for desktop GIS, e.g. /export/5121680800?layer=cadastre&format=gpkg
+        Formats: csv, geojsonseq (newline-delimited GeoJSON), fgb (FlatGeobuf with spatial index), gpkg (GeoPackage).
+        User polygons are exported only for their author.
+    :return: File or Error "400 BAD REQUEST"
+    """
+    layer = request.args.get("layer", "cadastre")
+    output_format = request.args.get("format", "csv")
+
+    try:
+        chunks = export_parcels(
+            koatuu, layer, output_format,
+            email=current_user.email, precision=current_app.config["GEOJSON_PRECISION"]
         )
+    except ValueError:
+        abort(400)
 
-    return jsonify(parcels)
+    mimetype, extension, _ = EXPORT_FORMATS[output_format]
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f'attachment; filename="{layer}_{koatuu}.{extension}"'
+
+    return response
 
 
 #   CREATE Polygon data   ----------------------------------------------------------------------------------------------
@@ -83,17 +541,29 @@ def get_parcels():
 @login_required
 @roles_required("cadastral_map")
 def add_polygon():
+    """
+        Save the polygon drawn by the user. Invalid polygons are repaired like on import and the area is computed
+        on the server, the one reported by the client is not trusted.
+    :return: 200 or Error "400 BAD REQUEST" if no polygon is left after the repair
+    """
+    try:
+        geometry = shape(json.loads(request.json["geojson"])["geometry"])
+    except (KeyError, TypeError, ValueError, AttributeError, ShapelyError):
+        abort(400)
+
+    result = validate_geometries([geometry])
+
+    if result["status"][0] == "rejected":
+        abort(400)
+
     count = session.query(Land.id).order_by(Land.id.desc()).first()
 
     new_polygon = Land(
         cadnum=count[0] + 1 if count is not None else 1,
-        area=float(request.json["area"]),
+        area=round(float(result["area"][0]), 4),
         ownership_code="0",
         purpose_code="00.00",
-        geometry=from_shape(shape({
-            "type": "MULTIPOLYGON",
-            "coordinates": [eval(request.json["geojson"])["geometry"]["coordinates"]]
-        }), srid=4326),
+        geometry=from_shape(result["geometry"][0], srid=4326),
         address=current_user.email
     )
 
@@ -0,0 +1,297 @@
+from flask import Blueprint, abort, current_app, Response
+from flask_security import current_user, login_required
+from grosland.app import get_data_version, read_from_replica, session
+from grosland.models import Cadastre, Archive, Land, District, Council, Village, ASCM, geometry_column
+from sqlalchemy import text
+import functools
+import hashlib
+import os
+import threading
+import uuid
+
+
+tiles = Blueprint("tiles", __name__, url_prefix="/tiles")
+tiles.before_request(read_from_replica)
+
+LAYERS = {model.__tablename__: model for model in (Cadastre, Archive, Land, District, Council, Village, ASCM)}
+
+#   Role required for the layer, the others belong to the cadastral map
+LAYER_ROLES = {
+    ASCM.__tablename__: "ascm_map",
+}
+
+#   Polygons drawn by the users, every user gets tiles of their own polygons only
+USER_LAYERS = (Land.__tablename__,)
+
+PARCEL_PROPERTIES = "t.cadnum, t.area::float AS area, t.address, t.ownership_code, t.purpose_code"
+
+ATU_PROPERTIES = 't.code, t."desc", t.area::float AS area'
+
+PROPERTIES = {
+    Cadastre: PARCEL_PROPERTIES,
+    Archive: PARCEL_PROPERTIES,
+    Land: PARCEL_PROPERTIES,
+    District: ATU_PROPERTIES,
+    Council: ATU_PROPERTIES,
+    Village: ATU_PROPERTIES,
+    ASCM: 't.code, t."desc", t.color',
+}
+
+MVT_QUERY = """
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS geom
+    ),
+    mvtgeom AS (
+        SELECT ST_AsMVTGeom(ST_Transform(t.{geometry}, 3857), bounds.geom) AS geom,
+               {properties}
+        FROM {table} t, bounds
+        WHERE t.geometry && ST_Transform(bounds.geom, 4326){filter}
+    )
+    SELECT ST_AsMVT(mvtgeom, :layer, 4096, 'geom') FROM mvtgeom
+"""
+
+
+#   Tile cache  --------------------------------------------------------------------------------------------------------
+class TileCache:
+    """
+        Bounded on-disk cache of rendered vector tiles keyed by layer/version/z/x/y.
+        Tiles of old data versions are never read again and are evicted first,
+        because when the cache grows above max_size, the least recently used tiles are removed.
+    """
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def tile_path(self, layer: str, version: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.path, layer, version, str(z), str(x), f"{y}.pbf")
+
+    def get(self, layer: str, version: str, z: int, x: int, y: int):
+        path = self.tile_path(layer, version, z, x, y)
+
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        #   Mark the tile as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return data
+
+    def set(self, layer: str, version: str, z: int, x: int, y: int, data: bytes):
+        path = self.tile_path(layer, version, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        #   Atomic write so that concurrent workers never read a partial tile
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.scan())
+            else:
+                self.size += len(data)
+
+            if self.size > self.max_size:
+                self.prune()
+
+    def scan(self):
+        """
+            Collect all cached tiles.
+        :return: [(path, size, mtime), ...]
+        """
+        result = []
+
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                result.append((path, stat.st_size, stat.st_mtime))
+
+        return result
+
+    def prune(self):
+        """
+            Remove the oldest tiles until the cache takes no more than 90% of max_size.
+        """
+        files = sorted(self.scan(), key=lambda item: item[2])
+        self.size = sum(size for _, size, _ in files)
+
+        for path, size, _ in files:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+    def clear(self, layer: str = None):
+        """
+            Remove cached tiles of one layer or the entire cache.
+        """
+        with self.lock:
+            for path, _, _ in self.scan():
+                if layer is None or os.path.relpath(path, self.path).split(os.sep)[0] == layer:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+            self.size = None
+
+
+def get_tile_cache() -> TileCache:
+    """
+        Tile cache of the current application.
+    """
+    if "tile_cache" not in current_app.extensions:
+        current_app.extensions["tile_cache"] = TileCache(
+            current_app.config["TILES_CACHE_DIR"],
+            current_app.config["TILES_CACHE_MAX_SIZE"]
+        )
+
+    return current_app.extensions["tile_cache"]
+
+
+def get_package():
+    """
+        Pre-rendered MBTiles package of the current application or None if TILES_MBTILES is not set.
+    """
+    if not current_app.config["TILES_MBTILES"]:
+        return None
+
+    if "tile_package" not in current_app.extensions:
+        from grosland.mbtiles import MBTiles
+
+        current_app.extensions["tile_package"] = MBTiles(current_app.config["TILES_MBTILES"])
+
+    return current_app.extensions["tile_package"]
+
+
+def local_tiles() -> bool:
+    """
+        Local mode: the tiles are served from the package to anyone, without the users and roles of the database.
+    """
+    return bool(current_app.config["TILES_LOCAL"] and current_app.config["TILES_MBTILES"])
+
+
+def tile_login_required(view):
+    """
+        login_required, which is skipped in the local mode.
+    """
+    authenticated = login_required(view)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return view(*args, **kwargs) if local_tiles() else authenticated(*args, **kwargs)
+
+    return wrapper
+
+
+def layer_role(layer: str) -> str:
+    return LAYER_ROLES.get(layer, "cadastral_map")
+
+
+def tile_query(layer: str, z: int) -> str:
+    """
+        MVT query of the layer. Low zooms are rendered from the generalized geometry,
+        the full one is used only for the index lookup. Points have no generalized columns.
+    """
+    model = LAYERS[layer]
+    geometry = geometry_column(z) if hasattr(model, geometry_column(z)) else "geometry"
+
+    return MVT_QUERY.format(
+        table=model.__tablename__, geometry=geometry, properties=PROPERTIES[model],
+        filter=" AND t.address = :email" if layer in USER_LAYERS else ""
+    )
+
+
+def tile_params(layer: str, z: int, x: int, y: int, email: str = None) -> dict:
+    """
+        Parameters of the tile query, user layers are filtered by the email of the user.
+    """
+    params = {"z": z, "x": x, "y": y, "layer": layer}
+
+    if layer in USER_LAYERS:
+        params["email"] = email
+
+    return params
+
+
+def cache_layer(layer: str, email: str = None) -> str:
+    """
+        Key of the layer in the tile cache. Tiles of user layers are cached per user,
+        under a hash so that the emails do not appear in the paths.
+    """
+    if layer not in USER_LAYERS:
+        return layer
+
+    return f"{layer}/{hashlib.sha256(str(email).encode()).hexdigest()[:32]}"
+
+
+def render_tile(layer: str, z: int, x: int, y: int, email: str = None) -> bytes:
+    """
+        Render a Mapbox vector tile of the layer directly in PostGIS.
+    :return: Tile in .pbf format
+    """
+    tile = session.execute(
+        text(tile_query(layer, z)),
+        tile_params(layer, z, x, y, email)
+    ).scalar()
+
+    return bytes(tile) if tile else b""
+
+
+#   GET Tile    --------------------------------------------------------------------------------------------------------
+@tiles.route("/<layer>/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"])
+@tile_login_required
+def get_tile(layer, z, x, y):
+    """
+        Vector tile of the cadastre, archive, land, ASCM or ATU (district, council, village) layer.
+        The land layer contains only the polygons of the current user.
+        With TILES_MBTILES the tiles are read from the pre-rendered package instead of the database,
+        with TILES_LOCAL as well they are served without login and roles.
+    :return: Tile in .pbf format or Error "403 FORBIDDEN", "404 PAGE NOT FOUND"
+    """
+    if layer not in LAYERS:
+        abort(404)
+
+    if not local_tiles() and not current_user.has_role(layer_role(layer)):
+        abort(403)
+
+    if not current_app.config["TILES_MIN_ZOOM"] <= z <= current_app.config["TILES_MAX_ZOOM"]:
+        abort(404)
+
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+
+    package = get_package()
+    if package is not None:
+        tile = package.get_layer(layer, z, x, y)
+
+        if tile is None:
+            abort(404)
+
+        return Response(tile, mimetype="application/vnd.mapbox-vector-tile")
+
+    cache = get_tile_cache()
+    version = get_data_version(layer)
+    key = cache_layer(layer, current_user.email)
+    tile = cache.get(key, version, z, x, y)
+
+    if tile is None:
+        tile = render_tile(layer, z, x, y, current_user.email)
+        cache.set(key, version, z, x, y, tile)
+
+    return Response(tile, mimetype="application/vnd.mapbox-vector-tile")
@@ -0,0 +1,257 @@
+from grosland.app import session
+from grosland.models import Cadastre, Archive, Land, Council
+from sqlalchemy import text
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+
+
+#   Parameters ---------------------------------------------------------------------------------------------------------
+EXPORT_MODELS = {model.__tablename__: model for model in (Cadastre, Archive, Land)}
+
+EXPORT_COLUMNS = ("cadnum", "ownership_code", "purpose_code", "area", "address")
+
+CHUNK_SIZE = 64 * 1024
+
+#   Format: (mimetype, file extension, geometry columns of the query)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv", "ST_AsText(t.geometry, :precision)"),
+    "geojsonseq": ("application/geo+json-seq", "geojsonl", "ST_AsGeoJSON(t.geometry, :precision)"),
+    "fgb": ("application/flatgeobuf", "fgb", "t.geometry"),
+    "gpkg": (
+        "application/geopackage+sqlite3", "gpkg",
+        "ST_AsBinary(t.geometry, 'NDR'), ST_XMin(t.geometry), ST_XMax(t.geometry), "
+        "ST_YMin(t.geometry), ST_YMax(t.geometry)"
+    ),
+}
+
+EXPORT_QUERY = """
+    SELECT t.cadnum, t.ownership_code, t.purpose_code, t.area::float AS area, t.address, {geometry}
+    FROM {table} t
+    WHERE {filter}
+    ORDER BY t.cadnum
+"""
+
+#   Plots are selected by the cadastral number, user polygons by the council containing them
+EXPORT_FILTERS = {
+    "parcels": "t.cadnum LIKE :prefix",
+    "land": f"""EXISTS (
+        SELECT 1 FROM {Council.__tablename__} c
+        WHERE c.code LIKE :prefix AND ST_Intersects(c.geometry, ST_PointOnSurface(t.geometry))
+    )""",
+}
+
+#   The spatial index of FlatGeobuf precedes the features, so PostGIS builds the whole file in one aggregate
+FLATGEOBUF_QUERY = """
+    SELECT ST_AsFlatGeobuf(q, true, 'geometry')
+    FROM ({query}) q
+"""
+
+GPKG_SRS = (
+    ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", None),
+    ("Undefined geographic SRS", 0, "NONE", 0, "undefined", None),
+    (
+        "WGS 84 geodetic", 4326, "EPSG", 4326,
+        'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+        'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+        'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+        "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid"
+    ),
+)
+
+GPKG_SCHEMA = """
+    PRAGMA application_id = 1196444487;
+    PRAGMA user_version = 10300;
+    CREATE TABLE gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT
+    );
+    CREATE TABLE gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+        description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+        srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id)
+    );
+    CREATE TABLE gpkg_geometry_columns (
+        table_name TEXT NOT NULL REFERENCES gpkg_contents(table_name), column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id),
+        z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name)
+    );
+"""
+
+
+#   Rows ---------------------------------------------------------------------------------------------------------------
+def export_query(layer: str, geometry: str, email: str = None) -> str:
+    """
+        Query of the plots of the layer in a KOATUU, user polygons are limited to the author if the email is given.
+    """
+    model = EXPORT_MODELS[layer]
+    query_filter = EXPORT_FILTERS["land" if model is Land else "parcels"]
+
+    if email is not None and model is Land:
+        query_filter += " AND t.address = :email"
+
+    return EXPORT_QUERY.format(table=model.__tablename__, geometry=geometry, filter=query_filter)
+
+
+def export_rows(query: str, params: dict):
+    """
+        Rows fetched from a server-side cursor, so only one batch is held in memory.
+    """
+    yield from session.execute(text(query).execution_options(yield_per=1000), params)
+
+
+#   Writers ------------------------------------------------------------------------------------------------------------
+def csv_chunks(rows):
+    """
+        CSV with the attributes and the WKT geometry, which desktop GIS open as a layer.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS + ("wkt",))
+
+    for row in rows:
+        writer.writerow(row)
+
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def geojsonseq_chunks(rows):
+    """
+        Newline-delimited GeoJSON features, geometries are rendered by PostGIS and not decoded.
+    """
+    chunk = []
+    size = 0
+
+    for *properties, geometry in rows:
+        line = (
+            '{"type": "Feature", "properties": '
+            + json.dumps(dict(zip(EXPORT_COLUMNS, properties)), ensure_ascii=False)
+            + ', "geometry": ' + geometry + "}\n"
+        )
+        chunk.append(line)
+        size += len(line)
+
+        if size >= CHUNK_SIZE:
+            yield "".join(chunk).encode()
+            chunk, size = [], 0
+
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def gpkg_geometry(wkb: bytes, xmin: float, xmax: float, ymin: float, ymax: float) -> bytes:
+    """
+        GeoPackage geometry: little endian header with the envelope followed by the WKB.
+    """
+    return b"GP" + struct.pack("<BBi4d", 0, 0b011, 4326, xmin, xmax, ymin, ymax) + bytes(wkb)
+
+
+def write_gpkg(path: str, table: str, rows, batch_size: int = 1000) -> int:
+    """
+        Write the rows into a new GeoPackage layer. A spatial index can be added by the desktop GIS.
+    :return: Number of features
+    """
+    connection = sqlite3.connect(path)
+    extent = None
+    count = 0
+
+    try:
+        connection.executescript(GPKG_SCHEMA)
+        connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", GPKG_SRS)
+        connection.execute(
+            f'CREATE TABLE "{table}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geometry MULTIPOLYGON, '
+            "cadnum TEXT, ownership_code TEXT, purpose_code TEXT, area REAL, address TEXT)"
+        )
+        connection.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, 4326)",
+            (table, table)
+        )
+        connection.execute(
+            "INSERT INTO gpkg_geometry_columns VALUES (?, 'geometry', 'MULTIPOLYGON', 4326, 0, 0)", (table,)
+        )
+
+        batch = []
+        for *properties, wkb, xmin, xmax, ymin, ymax in rows:
+            batch.append((gpkg_geometry(wkb, xmin, xmax, ymin, ymax), *properties))
+
+            if extent is None:
+                extent = [xmin, ymin, xmax, ymax]
+            else:
+                extent = [min(extent[0], xmin), min(extent[1], ymin), max(extent[2], xmax), max(extent[3], ymax)]
+
+            if len(batch) >= batch_size:
+                connection.executemany(f'INSERT INTO "{table}" VALUES (NULL, ?, ?, ?, ?, ?, ?)', batch)
+                count += len(batch)
+                batch = []
+
+        connection.executemany(f'INSERT INTO "{table}" VALUES (NULL, ?, ?, ?, ?, ?, ?)', batch)
+        count += len(batch)
+
+        if extent:
+            connection.execute(
+                "UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = ?",
+                (*extent, table)
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+    return count
+
+
+def gpkg_chunks(rows, table: str):
+    """
+        GeoPackage is a SQLite database, so it is written to a temporary file first and then sent.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"{table}.gpkg")
+        write_gpkg(path, table, rows)
+
+        with open(path, "rb") as file:
+            while chunk := file.read(CHUNK_SIZE):
+                yield chunk
+
+
+#   Export -------------------------------------------------------------------------------------------------------------
+def export_parcels(koatuu: str, layer: str, output_format: str, email: str = None, precision: int = 8):
+    """
+        Export the plots of the layer in the KOATUU. CSV and GeoJSONSeq are streamed as they are read,
+        GeoPackage and FlatGeobuf are sent once the file is complete.
+    :param koatuu: e.g. "5121680800", plots are selected by its first 8 digits like in get_parcels.
+    :param layer: "cadastre", "archive" or "land"
+    :param output_format: Key of EXPORT_FORMATS.
+    :param email: Author of the exported user polygons, None for all of them.
+    :param precision: Decimal digits of the coordinates in CSV and GeoJSONSeq.
+    :return: Generator of bytes
+    :raise ValueError: Invalid KOATUU, layer or format
+    """
+    if not re.fullmatch(r"\d{10}", koatuu or ""):
+        raise ValueError("Invalid KOATUU")
+
+    if layer not in EXPORT_MODELS or output_format not in EXPORT_FORMATS:
+        raise ValueError("Unknown layer or format")
+
+    query = export_query(layer, EXPORT_FORMATS[output_format][2], email)
+    params = {"prefix": f"{koatuu[:8]}%", "email": email, "precision": precision}
+
+    if output_format == "fgb":
+        return iter([bytes(session.execute(text(FLATGEOBUF_QUERY.format(query=query)), params).scalar() or b"")])
+
+    rows = export_rows(query, params)
+
+    if output_format == "gpkg":
+        return gpkg_chunks(rows, layer)
+
+    return csv_chunks(rows) if output_format == "csv" else geojsonseq_chunks(rows)
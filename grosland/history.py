@@ -0,0 +1,131 @@
+import atexit
+import datetime
+from grosland.models import History
+import logging
+import os
+import queue
+from sqlalchemy import insert
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+#   Write-behind -------------------------------------------------------------------------------------------------------
+class HistoryWriter:
+    """
+        Write-behind queue for the search history.
+        Rows are collected in-process and written by a background thread with one multi-row insert
+        as soon as batch_size rows are queued or interval seconds have passed since the first of them.
+    """
+    def __init__(self, bind=None, batch_size: int = 100, interval: float = 1.0):
+        self.bind = bind
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def init_app(self, app, bind):
+        self.bind = bind
+        self.batch_size = app.config["HISTORY_BATCH_SIZE"]
+        self.interval = app.config["HISTORY_FLUSH_INTERVAL"] / 1000
+
+        atexit.register(self.close)
+
+    @property
+    def depth(self) -> int:
+        """
+            Number of rows waiting to be written.
+        """
+        return self.queue.qsize()
+
+    def put(self, **row):
+        """
+            Enqueue a history row. All values, including user_id and user_ip, must be captured by the caller.
+        :param row: {"user_id": int, "user_ip": str, "message": str}
+        """
+        row.setdefault("date", datetime.datetime.now())
+
+        self.start()
+        self.queue.put(row)
+
+    def start(self):
+        """
+            Start the background thread in the current process (also after a fork of the worker).
+        """
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+
+            if self.pid != os.getpid():
+                self.queue = queue.Queue()
+
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self.run, name="history-writer", daemon=True)
+            self.thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """
+            Flush the queued rows and stop the background thread.
+        """
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+
+        self.queue.put(STOP)
+        self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            row = self.queue.get()
+            if row is STOP:
+                return
+
+            rows = [row]
+            deadline = time.monotonic() + self.interval
+            stop = False
+
+            while len(rows) < self.batch_size:
+                try:
+                    row = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+
+                if row is STOP:
+                    stop = True
+                    break
+                rows.append(row)
+
+            self.write(rows)
+
+            if stop:
+                return
+
+    def write(self, rows: list):
+        """
+            Write the rows with one multi-row insert. If it fails, the rows are retried one by one,
+            so that a single bad row does not drop the rows of other users.
+        """
+        try:
+            with self.bind.begin() as connection:
+                connection.execute(insert(History), rows)
+            return
+        except Exception:
+            if len(rows) == 1:
+                logger.exception("Failed to write a history row")
+                return
+            logger.warning("Failed to write %s history rows at once, retrying one by one", len(rows))
+
+        for row in rows:
+            try:
+                with self.bind.begin() as connection:
+                    connection.execute(insert(History), [row])
+            except Exception:
+                logger.exception("Failed to write a history row of user %s", row.get("user_id"))
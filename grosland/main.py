@@ -1,11 +1,14 @@
-from flask import render_template
-from flask_security import login_required
-from grosland.app import app, session
+from flask import Blueprint, render_template, Response
+from flask_security import login_required, roles_required
+from grosland.app import metrics, session
 from grosland.models import Updates
 
 
+main = Blueprint("main", __name__)
+
+
 #   Main routes --------------------------------------------------------------------------------------------------------
-@app.route("/", methods=["GET"])
+@main.route("/", methods=["GET"])
 @login_required
 def index():
     """
@@ -14,7 +17,7 @@ def index():
     return render_template("index.html")
 
 
-@app.route("/updates", methods=["GET"])
+@main.route("/updates", methods=["GET"])
 @login_required
 def show_updates():
     """
@@ -23,8 +26,17 @@ def show_updates():
     return render_template("updates.html", updates=session.query(Updates).order_by(Updates.date.desc()))
 
 
+@main.route("/metrics", methods=["GET"])
+@login_required
+@roles_required("admin")
+def show_metrics():
+    """
+        Request, SQL and connection pool metrics of the worker in Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 #   Event   ------------------------------------------------------------------------------------------------------------
-@app.teardown_appcontext
 def shutdown_session(exception=None):
     """
         Fixed error sqlalchemy.exc.TimeoutError
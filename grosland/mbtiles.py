@@ -0,0 +1,280 @@
+from grosland.blueprints.tiles import LAYERS, USER_LAYERS, tile_params, tile_query
+from grosland.models import Council, Village
+import gzip
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import sqlite3
+from sqlalchemy import create_engine, text
+import threading
+
+
+#   Parameters ---------------------------------------------------------------------------------------------------------
+MBTILES_SCHEMA = """
+    CREATE TABLE metadata (name TEXT, value TEXT);
+    CREATE UNIQUE INDEX metadata_name ON metadata (name);
+    CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+    CREATE TABLE images (tile_id TEXT, tile_data BLOB);
+    CREATE UNIQUE INDEX images_id ON images (tile_id);
+    CREATE VIEW tiles AS
+        SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row,
+               images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+EXTENT_QUERY = f"""
+    SELECT ST_XMin(extent), ST_YMin(extent), ST_XMax(extent), ST_YMax(extent)
+    FROM (
+        SELECT ST_Extent(geometry) AS extent
+        FROM (
+            SELECT geometry FROM {Council.__tablename__} WHERE code = :code
+            UNION ALL
+            SELECT geometry FROM {Village.__tablename__} WHERE code = :code
+        ) atu
+    ) e
+"""
+
+#   Attributes of the layers for the vector_layers metadata
+PARCEL_FIELDS = {"cadnum": "String", "area": "Number", "address": "String", "ownership_code": "String",
+                 "purpose_code": "String"}
+ATU_FIELDS = {"code": "String", "desc": "String", "area": "Number"}
+ASCM_FIELDS = {"code": "String", "desc": "String", "color": "String"}
+
+LAYER_FIELDS = {
+    "cadastre": PARCEL_FIELDS,
+    "archive": PARCEL_FIELDS,
+    "district": ATU_FIELDS,
+    "council": ATU_FIELDS,
+    "village": ATU_FIELDS,
+    "ascm": ASCM_FIELDS,
+}
+
+#   User layers (land) are served per user and are never packaged
+DEFAULT_LAYERS = ("cadastre", "archive", "ascm", "district", "council", "village")
+
+
+#   Tiles --------------------------------------------------------------------------------------------------------------
+def tile_range(bounds: tuple, z: int):
+    """
+        XYZ tiles of the zoom covering the bounds.
+    :param bounds: (xmin, ymin, xmax, ymax) in degrees
+    :return: Generator of (z, x, y)
+    """
+    n = 2 ** z
+
+    def column(lng):
+        return min(max(int((lng + 180) / 360 * n), 0), n - 1)
+
+    def row(lat):
+        lat = math.radians(max(min(lat, 85.0511), -85.0511))
+        return min(max(int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n), 0), n - 1)
+
+    for x in range(column(bounds[0]), column(bounds[2]) + 1):
+        for y in range(row(bounds[3]), row(bounds[1]) + 1):
+            yield z, x, y
+
+
+def fields(message: bytes):
+    """
+        Top-level fields of a protobuf message without decoding their values.
+    :return: Generator of (field number, start of the field, start of the value, end of the field)
+    """
+    def varint(position):
+        result = shift = 0
+        while True:
+            byte = message[position]
+            result |= (byte & 0x7F) << shift
+            position += 1
+            if not byte & 0x80:
+                return result, position
+            shift += 7
+
+    position = 0
+    while position < len(message):
+        start = position
+        key, position = varint(position)
+        wire_type = key & 0x07
+
+        if wire_type == 0:
+            _, end = varint(position)
+        elif wire_type == 1:
+            end = position + 8
+        elif wire_type == 2:
+            length, position = varint(position)
+            end = position + length
+        elif wire_type == 5:
+            end = position + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+
+        yield key >> 3, start, position, end
+        position = end
+
+
+def split_layers(tile: bytes) -> dict:
+    """
+        Split a Mapbox vector tile into single-layer tiles. A tile is a list of layers (field 3)
+        and every layer starts with its name (field 1), so nothing else is decoded.
+    :return: {"cadastre": b"...", ...}
+    """
+    result = {}
+
+    for number, start, value, end in fields(tile):
+        if number != 3:
+            continue
+
+        layer = tile[value:end]
+        name = next((layer[s:e].decode() for n, _, s, e in fields(layer) if n == 1), None)
+        result[name] = result.get(name, b"") + tile[start:end]
+
+    return result
+
+
+#   Builder ------------------------------------------------------------------------------------------------------------
+#   Connection and layers of a pool worker, every process connects on its own
+worker = {}
+
+
+def init_worker(uri: str, layers: tuple):
+    worker["engine"] = create_engine(uri, pool_size=1)
+    worker["layers"] = layers
+
+
+def render_tiles(tiles: list) -> list:
+    """
+        Render tiles with all layers of the package, a tile of several layers is the concatenation of single-layer
+        tiles.
+    :param tiles: [(z, x, y), ...]
+    :return: [(z, x, y, tile), ...]
+    """
+    result = []
+
+    with worker["engine"].connect() as connection:
+        for z, x, y in tiles:
+            tile = b""
+
+            for layer in worker["layers"]:
+                data = connection.execute(
+                    text(tile_query(layer, z)), tile_params(layer, z, x, y)
+                ).scalar()
+                tile += bytes(data) if data else b""
+
+            result.append((z, x, y, tile))
+
+    return result
+
+
+def build_mbtiles(engine, path: str, code: str, min_zoom: int, max_zoom: int, layers=DEFAULT_LAYERS,
+                  processes: int = None, batch_size: int = 64) -> dict:
+    """
+        Pre-render the layers inside the extent of the council or village into an MBTiles file.
+        Tiles are rendered by a process pool and stored once per content, so the many identical
+        (mostly empty) tiles share one row of the deduplicated MBTiles schema.
+    :param engine: Engine of the database, the workers connect with its URL.
+    :param code: Code of the council or village, e.g. "5121680800".
+    :param layers: Layers of the tiles blueprint.
+    :param processes: Number of worker processes, by default the number of CPUs.
+    :return: {"tiles": int, "unique": int, "empty": int}
+    :raise ValueError: Unknown or user layer, unknown ATU code
+    """
+    if any(layer not in LAYERS or layer in USER_LAYERS for layer in layers):
+        raise ValueError("Unknown layer or layer of the users")
+
+    with engine.connect() as connection:
+        bounds = connection.execute(text(EXTENT_QUERY), {"code": code}).one()
+
+    if bounds[0] is None:
+        raise ValueError(f"Council or village {code} not found")
+
+    temp_path = f"{path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    package = sqlite3.connect(temp_path)
+    result = {"tiles": 0, "unique": 0, "empty": 0}
+
+    try:
+        package.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + MBTILES_SCHEMA)
+        package.executemany("INSERT INTO metadata VALUES (?, ?)", [
+            ("name", f"grosland {code}"),
+            ("format", "pbf"),
+            ("type", "overlay"),
+            ("version", "1"),
+            ("bounds", ",".join(str(value) for value in bounds)),
+            ("center", f"{(bounds[0] + bounds[2]) / 2},{(bounds[1] + bounds[3]) / 2},{min_zoom}"),
+            ("minzoom", str(min_zoom)),
+            ("maxzoom", str(max_zoom)),
+            ("json", json.dumps({"vector_layers": [
+                {"id": layer, "fields": LAYER_FIELDS[layer], "minzoom": min_zoom, "maxzoom": max_zoom}
+                for layer in layers
+            ]})),
+        ])
+
+        tiles = [tile for z in range(min_zoom, max_zoom + 1) for tile in tile_range(bounds, z)]
+        batches = [tiles[index:index + batch_size] for index in range(0, len(tiles), batch_size)]
+        uri = engine.url.render_as_string(hide_password=False)
+
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(uri, tuple(layers))) as pool:
+            for rendered in pool.imap_unordered(render_tiles, batches):
+                for z, x, y, tile in rendered:
+                    tile_id = hashlib.md5(tile).hexdigest()
+
+                    if package.execute(
+                        "INSERT OR IGNORE INTO images VALUES (?, ?)", (tile_id, gzip.compress(tile, 9, mtime=0))
+                    ).rowcount:
+                        result["unique"] += 1
+
+                    #   MBTiles rows are numbered from the south (TMS)
+                    package.execute("INSERT INTO map VALUES (?, ?, ?, ?)", (z, x, 2 ** z - 1 - y, tile_id))
+                    result["tiles"] += 1
+                    result["empty"] += not tile
+
+        package.execute("CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row)")
+        package.commit()
+    finally:
+        package.close()
+
+    os.replace(temp_path, path)
+
+    return result
+
+
+#   Reader -------------------------------------------------------------------------------------------------------------
+class MBTiles:
+    """
+        Read-only access to an MBTiles package through memory-mapped SQLite, one connection per thread.
+    """
+    def __init__(self, path: str, mmap_size: int = 256 * 1024 * 1024):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        if not hasattr(self.local, "connection"):
+            self.local.connection = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+            self.local.connection.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+
+        return self.local.connection
+
+    def get(self, z: int, x: int, y: int):
+        """
+            Tile with all layers of the package.
+        :return: Tile in .pbf format or None outside of the package
+        """
+        row = self.connection().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, 2 ** z - 1 - y)
+        ).fetchone()
+
+        return gzip.decompress(row[0]) if row else None
+
+    def get_layer(self, layer: str, z: int, x: int, y: int):
+        """
+            Tile of one layer, like the tiles rendered by PostGIS.
+        :return: Tile in .pbf format or None outside of the package
+        """
+        tile = self.get(z, x, y)
+
+        return None if tile is None else split_layers(tile).get(layer, b"")
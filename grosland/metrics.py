@@ -0,0 +1,257 @@
+from collections import defaultdict
+from flask import g, has_request_context, request
+import logging
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+#   Histogram ----------------------------------------------------------------------------------------------------------
+class Histogram:
+    """
+        Cumulative histogram in terms of Prometheus.
+    """
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: dict) -> list:
+        result = [
+            f"{name}_bucket{format_labels({**labels, 'le': str(bucket)})} {count}"
+            for bucket, count in zip(self.buckets, self.counts)
+        ]
+        result.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {self.count}")
+        result.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        result.append(f"{name}_count{format_labels(labels)} {self.count}")
+
+        return result
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    values = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+
+    return "{" + ",".join(values) + "}"
+
+
+#   Pool ---------------------------------------------------------------------------------------------------------------
+class TimedQueuePool(QueuePool):
+    """
+        QueuePool, which reports how long a checkout waited for a free connection.
+    """
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_pool_wait(time.perf_counter() - start)
+
+
+#   Metrics ------------------------------------------------------------------------------------------------------------
+class Metrics:
+    """
+        Per-process request, SQL and connection pool metrics exported in Prometheus text format.
+        Statements slower than slow_query_threshold seconds are logged together with their EXPLAIN plan.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self.sql_time = defaultdict(float)
+        self.pool_wait = Histogram(LATENCY_BUCKETS)
+        self.gauges = {}
+        self.slow_query_threshold = None
+        self.explain = True
+
+    def init_app(self, app, engine):
+        self.slow_query_threshold = app.config["METRICS_SLOW_QUERY_THRESHOLD"] / 1000
+        self.explain = app.config["METRICS_EXPLAIN_SLOW_QUERIES"]
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+        self.instrument(engine)
+
+    def instrument(self, engine):
+        """
+            Collect SQL and pool metrics of the engine, e.g. of a read replica.
+        """
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(engine, "handle_error", self.handle_error)
+
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.metrics = self
+
+    def gauge(self, name: str, description: str, function):
+        """
+            Register a gauge, whose value is read by the function at scrape time.
+        """
+        self.gauges[name] = (description, function)
+
+    #   Flask ----------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def before_request():
+        g.metrics = {"start": time.perf_counter(), "statements": 0, "sql_time": 0.0}
+
+    def after_request(self, response):
+        """
+            The request is recorded when the response is closed, so that the body of streamed responses
+            (search, exports) and its SQL statements are included.
+        """
+        state = g.get("metrics")
+
+        if state is None:
+            return response
+
+        key = (request.endpoint or "unknown", request.method, str(response.status_code))
+        response.call_on_close(lambda: self.record(key, state))
+
+        return response
+
+    def record(self, key: tuple, state: dict):
+        endpoint = key[0]
+
+        with self.lock:
+            self.requests[key] += 1
+            self.latency[endpoint].observe(time.perf_counter() - state["start"])
+            self.statements[endpoint].observe(state["statements"])
+            self.sql_time[endpoint] += state["sql_time"]
+
+    def observe_pool_wait(self, seconds: float):
+        with self.lock:
+            self.pool_wait.observe(seconds)
+
+    #   SQLAlchemy -----------------------------------------------------------------------------------------------------
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_start"].pop()
+
+        if has_request_context() and "metrics" in g:
+            g.metrics["statements"] += 1
+            g.metrics["sql_time"] += elapsed
+
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            plan = self.explain_statement(conn, statement, parameters) if not executemany else None
+            logger.warning(
+                "Slow query %.3f s on %s:\n%s\n%s",
+                elapsed, request.endpoint if has_request_context() else None, statement, plan or ""
+            )
+
+    @staticmethod
+    def handle_error(context):
+        """
+            A failed statement never reaches after_cursor_execute, so its start time is removed here.
+        """
+        conn = context.connection
+
+        if conn is not None and context.execution_context is not None and conn.info.get("metrics_start"):
+            conn.info["metrics_start"].pop()
+
+    def explain_statement(self, conn, statement: str, parameters):
+        """
+            EXPLAIN plan of a read statement. A savepoint keeps the current transaction usable
+            even if the statement can not be explained.
+        """
+        if not self.explain or conn.dialect.name != "postgresql":
+            return None
+
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT metrics_explain")
+            try:
+                cursor.execute("EXPLAIN " + statement, parameters)
+                return "\n".join(row[0] for row in cursor.fetchall())
+            except Exception:
+                cursor.execute("ROLLBACK TO SAVEPOINT metrics_explain")
+                return None
+            finally:
+                cursor.execute("RELEASE SAVEPOINT metrics_explain")
+        except Exception:
+            logger.exception("Failed to explain slow query")
+            return None
+        finally:
+            cursor.close()
+
+    #   Export ---------------------------------------------------------------------------------------------------------
+    def render(self) -> str:
+        """
+            Metrics in Prometheus text exposition format.
+        """
+        lines = []
+
+        with self.lock:
+            lines += [
+                "# HELP grosland_requests_total Number of HTTP requests.",
+                "# TYPE grosland_requests_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                labels = {"endpoint": endpoint, "method": method, "status": status}
+                lines.append(f"grosland_requests_total{format_labels(labels)} {count}")
+
+            lines += [
+                "# HELP grosland_request_duration_seconds Request latency.",
+                "# TYPE grosland_request_duration_seconds histogram",
+            ]
+            for endpoint, histogram in sorted(self.latency.items()):
+                lines += histogram.render("grosland_request_duration_seconds", {"endpoint": endpoint})
+
+            lines += [
+                "# HELP grosland_sql_statements_per_request SQL statements executed by one request.",
+                "# TYPE grosland_sql_statements_per_request histogram",
+            ]
+            for endpoint, histogram in sorted(self.statements.items()):
+                lines += histogram.render("grosland_sql_statements_per_request", {"endpoint": endpoint})
+
+            lines += [
+                "# HELP grosland_sql_duration_seconds_total Time spent in SQL statements.",
+                "# TYPE grosland_sql_duration_seconds_total counter",
+            ]
+            for endpoint, seconds in sorted(self.sql_time.items()):
+                lines.append(f"grosland_sql_duration_seconds_total{format_labels({'endpoint': endpoint})} {seconds}")
+
+            lines += [
+                "# HELP grosland_pool_checkout_wait_seconds Time waited for a free database connection.",
+                "# TYPE grosland_pool_checkout_wait_seconds histogram",
+            ]
+            lines += self.pool_wait.render("grosland_pool_checkout_wait_seconds", {})
+
+        for name, (description, function) in sorted(self.gauges.items()):
+            lines += [
+                f"# HELP {name} {description}",
+                f"# TYPE {name} gauge",
+                f"{name} {function()}",
+            ]
+
+        return "\n".join(lines) + "\n"
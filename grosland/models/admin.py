@@ -1,12 +1,15 @@
-from flask import redirect, url_for, request
+from flask import current_app, redirect, url_for, request
 from flask_admin import AdminIndexView
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form import BaseForm
 from flask_security import current_user
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
+import hashlib
+import json
 from markupsafe import Markup
 import os
+from sqlalchemy.orm import defer, joinedload
 import uuid
 from wtforms import StringField, TextAreaField
 from wtforms.validators import DataRequired
@@ -44,6 +47,98 @@ class UpdatesForm(FlaskForm):
     image = FileField('Image', validators=[FileAllowed(['jpg', 'png'], 'Images only!')])
 
 
+class GeneralizedMixin:
+    """
+        Hides the simplified geometries, they are maintained by the database.
+    """
+    column_exclude_list = ("geometry_z8", "geometry_z10", "geometry_z12",)
+    form_excluded_columns = ("geometry_z8", "geometry_z10", "geometry_z12",)
+    column_details_exclude_list = ("geometry_z8", "geometry_z10", "geometry_z12",)
+
+
+class LotsListMixin:
+    """
+        Fast list of a large lots table: the geometry is not loaded, ownership and purpose are joined,
+        above ADMIN_EXACT_COUNT_LIMIT rows the count is the planner estimate instead of COUNT(*).
+        Lists are sorted only by the unique cadnum, so the next page is read after the last cadnum
+        of the previous one (keyset), the offset is used only for pages opened out of sequence.
+    """
+    column_list = ("cadnum", "ownership", "purpose", "area", "address",)
+    column_sortable_list = ("cadnum",)
+    column_default_sort = "cadnum"
+    column_searchable_list = ("cadnum", "address",)
+
+    def get_query(self):
+        return super().get_query().options(
+            defer(self.model.geometry), joinedload(self.model.ownership), joinedload(self.model.purpose)
+        )
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        from grosland.app import cache, get_data_version
+
+        joins, count_joins = {}, {}
+        query = self.get_query()
+        count_query = self.get_count_query() if not self.simple_list_pager else None
+
+        if self._search_supported and search:
+            query, count_query, joins, count_joins = self._apply_search(query, count_query, joins, count_joins, search)
+
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters
+            )
+
+        count = self.count_rows(count_query) if count_query is not None else None
+
+        sort_desc = bool(sort_desc) if sort_column is not None else False
+        query = query.order_by(self.model.cadnum.desc() if sort_desc else self.model.cadnum.asc())
+
+        page_size = self.page_size if page_size is None else page_size
+        if not page_size:
+            return count, query.all() if execute else query
+
+        #   Last cadnum of every page is the anchor of the next one while the data version is the same
+        key = "admin/{}/{}/{}".format(
+            self.model.__tablename__,
+            get_data_version(self.model.__tablename__),
+            hashlib.sha1(json.dumps([search, filters, sort_desc, page_size], default=str).encode()).hexdigest()
+        )
+        anchor = cache.get(f"{key}/{page}") if page else None
+
+        if anchor is not None:
+            query = query.filter(self.model.cadnum < anchor if sort_desc else self.model.cadnum > anchor)
+            query = query.limit(page_size)
+        else:
+            query = self._apply_pagination(query, page, page_size)
+
+        if not execute:
+            return count, query
+
+        rows = query.all()
+        if len(rows) == page_size:
+            cache.set(f"{key}/{page + 1}", rows[-1].cadnum)
+
+        return count, rows
+
+    def count_rows(self, count_query) -> int:
+        """
+            Number of rows of the list, estimated by the PostgreSQL planner for large tables.
+        """
+        bind = self.session.get_bind()
+
+        if bind.dialect.name == "postgresql":
+            statement = count_query.statement.with_only_columns(self.model.id).compile(dialect=bind.dialect)
+            plan = self.session.connection().exec_driver_sql(
+                "EXPLAIN (FORMAT JSON) " + str(statement), statement.params
+            ).scalar()
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+
+            if estimate >= current_app.config["ADMIN_EXACT_COUNT_LIMIT"]:
+                return estimate
+
+        return count_query.scalar()
+
+
 #   Admin --------------------------------------------------------------------------------------------------------------
 class AdminView(AdminIndexView):
     """
@@ -87,32 +182,34 @@ class PurposeView(ModelView):
 
 
 #   ATU ----------------------------------------------------------------------------------------------------------------
-class StateView(ModelView):
+class StateView(GeneralizedMixin, ModelView):
     pass
 
 
-class DistrictView(ModelView):
+class DistrictView(GeneralizedMixin, ModelView):
     pass
 
 
-class CouncilView(ModelView):
+class CouncilView(GeneralizedMixin, ModelView):
     pass
 
 
-class VillageView(ModelView):
+class VillageView(GeneralizedMixin, ModelView):
     pass
 
 
 #   Lots    ------------------------------------------------------------------------------------------------------------
-class CadastreView(ModelView):
-    pass
+class CadastreView(GeneralizedMixin, LotsListMixin, ModelView):
+    column_list = LotsListMixin.column_list + ("council_code", "village_code",)
+    form_excluded_columns = GeneralizedMixin.form_excluded_columns + ("council_code", "village_code",)
 
 
-class ArchiveView(ModelView):
-    pass
+class ArchiveView(GeneralizedMixin, LotsListMixin, ModelView):
+    column_list = LotsListMixin.column_list + ("council_code", "village_code",)
+    form_excluded_columns = GeneralizedMixin.form_excluded_columns + ("council_code", "village_code",)
 
 
-class LandView(ModelView):
+class LandView(GeneralizedMixin, LotsListMixin, ModelView):
     pass
 
 
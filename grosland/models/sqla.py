@@ -3,8 +3,8 @@ from flask import request
 from flask_security import UserMixin, RoleMixin, hash_password, current_user
 from geoalchemy2 import Geometry
 from shapely.wkb import loads
-from sqlalchemy import ForeignKey, Column, String, Integer, DECIMAL, Boolean, DateTime, event
-from sqlalchemy.orm import DeclarativeBase, relationship, backref, declared_attr
+from sqlalchemy import ForeignKey, Column, String, Integer, DECIMAL, Boolean, DateTime, DDL, event
+from sqlalchemy.orm import DeclarativeBase, relationship, backref, declared_attr, deferred
 
 
 __all__ = [
@@ -14,10 +14,86 @@ __all__ = [
     "State", "District", "Council", "Village",
     "Cadastre", "Archive", "Land",
     "ASCM",
-    "History", "Updates"
+    "History", "Updates",
+    "GENERALIZATION_ZOOMS", "geometry_column",
+    "PARCEL_STATISTICS"
 ]
 
 
+#   Generalization -----------------------------------------------------------------------------------------------------
+#   Polygons are also stored simplified for these zooms in geometry_z<zoom> columns
+GENERALIZATION_ZOOMS = (8, 10, 12)
+
+
+def generalization_tolerance(zoom: int) -> float:
+    """
+        Size of one pixel of a 256 px tile at the zoom in degrees.
+    """
+    return 360 / (256 * 2 ** zoom)
+
+
+def geometry_column(zoom: int = None) -> str:
+    """
+        Column with the lightest geometry that is still accurate enough for the zoom.
+    :param zoom: Map zoom or None for the full resolution.
+    :return: "geometry_z8", ... or "geometry"
+    """
+    if zoom is not None:
+        for level in GENERALIZATION_ZOOMS:
+            if zoom <= level:
+                return f"geometry_z{level}"
+
+    return "geometry"
+
+
+#   Fills the generalized columns of any polygonal table, including rows loaded with COPY
+GENERALIZE_FUNCTION = DDL(
+    "CREATE OR REPLACE FUNCTION generalize_geometry() RETURNS trigger AS $$ BEGIN "
+    + " ".join(
+        f"NEW.geometry_z{zoom} := "
+        f"ST_Multi(ST_SimplifyPreserveTopology(NEW.geometry, {generalization_tolerance(zoom)}));"
+        for zoom in GENERALIZATION_ZOOMS
+    )
+    + " RETURN NEW; END; $$ LANGUAGE plpgsql"
+)
+
+GENERALIZE_TRIGGER = DDL(
+    "CREATE TRIGGER %(table)s_generalize BEFORE INSERT OR UPDATE OF geometry ON %(table)s "
+    "FOR EACH ROW EXECUTE FUNCTION generalize_geometry()"
+)
+
+
+#   ATU assignment -----------------------------------------------------------------------------------------------------
+#   A plot belongs to the council and village containing its point on surface, so it is counted only once
+ASSIGN_ATU_FUNCTION = DDL(
+    "CREATE OR REPLACE FUNCTION assign_atu() RETURNS trigger AS $$ "
+    "DECLARE location geometry := ST_PointOnSurface(NEW.geometry); BEGIN "
+    "NEW.council_code := (SELECT code FROM council WHERE ST_Intersects(council.geometry, location) "
+    "ORDER BY code LIMIT 1); "
+    "NEW.village_code := (SELECT code FROM village WHERE ST_Intersects(village.geometry, location) "
+    "ORDER BY code LIMIT 1); "
+    "RETURN NEW; END; $$ LANGUAGE plpgsql"
+)
+
+ASSIGN_ATU_TRIGGER = DDL(
+    "CREATE TRIGGER %(table)s_assign_atu BEFORE INSERT OR UPDATE OF geometry ON %(table)s "
+    "FOR EACH ROW EXECUTE FUNCTION assign_atu()"
+)
+
+
+#   Materialized number and area of the current plots by ATU, ownership and purpose
+PARCEL_STATISTICS = "parcel_statistics"
+
+PARCEL_STATISTICS_VIEW = DDL(
+    f"CREATE MATERIALIZED VIEW IF NOT EXISTS {PARCEL_STATISTICS} AS "
+    "SELECT council_code, village_code, ownership_code, purpose_code, count(*) AS count, sum(area) AS area "
+    "FROM cadastre GROUP BY council_code, village_code, ownership_code, purpose_code; "
+    #   The unique index allows REFRESH MATERIALIZED VIEW CONCURRENTLY
+    f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{PARCEL_STATISTICS}_key "
+    f"ON {PARCEL_STATISTICS} (council_code, village_code, ownership_code, purpose_code)"
+)
+
+
 #   Base ---------------------------------------------------------------------------------------------------------------
 class Base(DeclarativeBase):
     """
@@ -50,6 +126,18 @@ class MultipolygonMixin:
     address = Column(String(255))
     geometry = Column(Geometry(geometry_type="MULTIPOLYGON", srid=4326), nullable=False)
 
+    @declared_attr
+    def geometry_z8(self):
+        return deferred(Column(Geometry(geometry_type="MULTIPOLYGON", srid=4326, spatial_index=False)))
+
+    @declared_attr
+    def geometry_z10(self):
+        return deferred(Column(Geometry(geometry_type="MULTIPOLYGON", srid=4326, spatial_index=False)))
+
+    @declared_attr
+    def geometry_z12(self):
+        return deferred(Column(Geometry(geometry_type="MULTIPOLYGON", srid=4326, spatial_index=False)))
+
     def wkb_to_geojson(self):
         """
             Convert WKBElement to Geojson format from polygonal object.
@@ -95,6 +183,14 @@ class PointMixin:
         return str(self.id)
 
 
+class AtuMixin:
+    """
+        Codes of the council and village of the plot, they are assigned by the database.
+    """
+    council_code = Column(String, index=True)
+    village_code = Column(String, index=True)
+
+
 class ParametersMixin:
     """
         Additional parameters for main polygonal objects.
@@ -210,14 +306,14 @@ class Village(Base, MultipolygonMixin, CodeDescMixin):
 
 
 #   Lots    ------------------------------------------------------------------------------------------------------------
-class Cadastre(Base, MultipolygonMixin, ParametersMixin):
+class Cadastre(Base, MultipolygonMixin, ParametersMixin, AtuMixin):
     """
         The current cadastral information.
     """
     pass
 
 
-class Archive(Base, MultipolygonMixin, ParametersMixin):
+class Archive(Base, MultipolygonMixin, ParametersMixin, AtuMixin):
     """
         The archive cadastral information.
     """
@@ -268,6 +364,19 @@ class Updates(Base):
 
 
 #   Event --------------------------------------------------------------------------------------------------------------
+event.listen(Base.metadata, "before_create", GENERALIZE_FUNCTION.execute_if(dialect="postgresql"))
+
+event.listen(Base.metadata, "before_create", ASSIGN_ATU_FUNCTION.execute_if(dialect="postgresql"))
+
+for model in (State, District, Council, Village, Cadastre, Archive, Land):
+    event.listen(model.__table__, "after_create", GENERALIZE_TRIGGER.execute_if(dialect="postgresql"))
+
+for model in (Cadastre, Archive):
+    event.listen(model.__table__, "after_create", ASSIGN_ATU_TRIGGER.execute_if(dialect="postgresql"))
+
+event.listen(Cadastre.__table__, "after_create", PARCEL_STATISTICS_VIEW.execute_if(dialect="postgresql"))
+
+
 @event.listens_for(Users.password, 'set', retval=True)
 def hash_user_password(target, value, oldvalue, initiator):
     """
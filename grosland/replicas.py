@@ -0,0 +1,47 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+import itertools
+import threading
+
+
+#   Routing session ----------------------------------------------------------------------------------------------------
+class RoutingSession(Session):
+    """
+        Session, which reads from the replica engine in info["replica"] (set by the read-only blueprints)
+        and sends flushes and DML statements to the primary it is bound to.
+    """
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get("replica")
+
+        if replica is not None and not self._flushing and not getattr(clause, "is_dml", False):
+            return replica
+
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+#   Replicas -----------------------------------------------------------------------------------------------------------
+class Replicas:
+    """
+        Engines of the read replicas from SQLALCHEMY_REPLICA_URIS, which are used round-robin.
+    """
+    def __init__(self):
+        self.engines = []
+        self.cycle = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app, **kwargs):
+        """
+        :param kwargs: Arguments of create_engine, e.g. the pool class of the primary.
+        """
+        self.engines = [create_engine(uri, **kwargs) for uri in app.config["SQLALCHEMY_REPLICA_URIS"]]
+        self.cycle = itertools.cycle(self.engines) if self.engines else None
+
+    def next(self):
+        """
+            Next replica engine or None if there are no replicas.
+        """
+        if self.cycle is None:
+            return None
+
+        with self.lock:
+            return next(self.cycle)
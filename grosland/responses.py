@@ -0,0 +1,158 @@
+from flask import current_app, make_response, request
+from flask_security import current_user
+from grosland.app import get_data_version
+import functools
+import gzip
+import hashlib
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_MIMETYPES = (
+    "application/json", "application/geo+json", "application/geo+json-seq", "text/csv", "text/plain"
+)
+ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+#   Conditional GET ----------------------------------------------------------------------------------------------------
+def matching_etag(etag: str):
+    """
+        Tag from If-None-Match, which names the etag in any content encoding ("<etag>" or "<etag>-gzip").
+    :return: The client's tag or None
+    """
+    for value in request.if_none_match:
+        if value.partition("-")[0] == etag:
+            return value
+
+    return None
+
+
+def not_modified(value: str):
+    response = current_app.response_class(status=304)
+    response.set_etag(value)
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    return response
+
+
+def conditional(*tables: str, private: bool = False):
+    """
+        Strong ETag for a read endpoint.
+        With tables the etag is derived from their data version and the request, so If-None-Match
+        is answered with 304 before the view (and its cache) is called.
+        Without tables the etag is the hash of the response content.
+    :param tables: Tables the response depends on, e.g. "cadastre", "archive".
+    :param private: The response depends on the current user.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = None
+
+            if tables:
+                user = current_user.id if private else ""
+                etag = hashlib.sha1(f"{get_data_version(*tables)}:{user}:{request.full_path}".encode()).hexdigest()
+                value = matching_etag(etag)
+
+                if value:
+                    return not_modified(value)
+
+            response = make_response(view(*args, **kwargs))
+
+            if response.status_code != 200:
+                return response
+
+            if etag is None and not response.is_streamed:
+                etag = hashlib.sha1(response.get_data()).hexdigest()
+                value = matching_etag(etag)
+
+                if value:
+                    return not_modified(value)
+
+            if etag is not None:
+                response.set_etag(etag)
+                response.headers["Cache-Control"] = "private, no-cache"
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+#   Compression --------------------------------------------------------------------------------------------------------
+def compressor(encoding: str) -> tuple:
+    """
+        Incremental compressor of the encoding.
+    :return: (compress(data) -> bytes, flush() -> bytes)
+    """
+    if encoding == "br":
+        instance = brotli.Compressor(quality=current_app.config["COMPRESS_BROTLI_QUALITY"])
+        return instance.process, instance.finish
+
+    instance = zlib.compressobj(current_app.config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return instance.compress, instance.flush
+
+
+def compress_stream(chunks, encoding: str):
+    """
+        Compress the chunks of a streamed response. The compressor is created in the request context.
+    """
+    compress, flush = compressor(encoding)
+
+    def generate():
+        for chunk in chunks:
+            data = compress(chunk)
+            if data:
+                yield data
+
+        yield flush()
+
+    return generate()
+
+
+def compress(response):
+    """
+        after_request hook: compress JSON responses with brotli or gzip.
+        Streamed responses are compressed on the fly, the others only above COMPRESS_MIN_SIZE bytes.
+    """
+    if (
+        response.status_code != 200
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.iter_encoded(), encoding)
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        if encoding == "br":
+            response.set_data(brotli.compress(data, quality=current_app.config["COMPRESS_BROTLI_QUALITY"]))
+        else:
+            response.set_data(gzip.compress(data, current_app.config["COMPRESS_GZIP_LEVEL"]))
+
+    response.headers["Content-Encoding"] = encoding
+
+    #   Each content encoding is a different representation with its own strong etag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+
+    return response
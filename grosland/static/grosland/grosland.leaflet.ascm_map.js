@@ -23,7 +23,7 @@ L.control.locate({
 
 //  ASCM   -------------------------------------------------------------------------------------------------------------
 ascm = L.vectorGrid.protobuf(
-    'https://grosland.fun/geoserver/gwc/service/tms/1.0.0/grosland:ascm@EPSG%3A900913@pbf/{z}/{x}/{-y}.pbf', {
+    '/tiles/ascm/{z}/{x}/{y}.pbf', {
         minZoom: 14,
         maxZoom: 18,
         interactive: true,
@@ -57,12 +57,50 @@ ascm = L.vectorGrid.protobuf(
 });
 
 
+//  Clusters -----------------------------------------------------------------------------------------------------------
+//  Below the zoom of the point tiles markers are shown as clusters computed by the server
+const pointsMinZoom = 14;
+
+clusters = L.layerGroup();
+
+function clusterMarker(feature, latlng) {
+    let count = feature.properties.count;
+
+    return L.circleMarker(latlng, {
+        color: feature.properties.color,
+        fillOpacity: 0.6,
+        radius: Math.min(8 + 4 * Math.log10(count), 30),
+    })
+    .bindTooltip(count.toString(), { permanent: count > 1, direction: 'center' })
+    .on('click', () => map.setView(latlng, Math.min(map.getZoom() + 2, pointsMinZoom)));
+};
+
+function loadClusters() {
+    if (map.getZoom() >= pointsMinZoom) {
+        clusters.clearLayers();
+        return;
+    };
+
+    fetch('/ascm_map/clusters?bbox=' + map.getBounds().toBBoxString() + '&zoom=' + map.getZoom())
+    .then(response => response.json())
+    .then(data => {
+        clusters.clearLayers();
+        clusters.addLayer(L.geoJSON(data, { pointToLayer: clusterMarker }));
+    })
+    .catch(error => console.error('Error loading clusters:', error));
+};
+
+map.on('moveend', loadClusters);
+loadClusters();
+
+
 //  LayerControl -------------------------------------------------------------------------------------------------------
 L.control.layers({
     'OpenStreetMap': L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png').addTo(map),
     'EsriMap': L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'),
 }, {
-    'ASCM': ascm.addTo(map)
+    'ASCM': ascm.addTo(map),
+    'ASCM clusters': clusters.addTo(map),
 }).addTo(map);
 
 
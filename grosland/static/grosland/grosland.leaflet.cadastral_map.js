@@ -2,12 +2,16 @@
 const coordinates = new Map();
 const minZoom = 9;
 const maxZoom = 18;
-const baseUrl = 'https://grosland.fun';
 const mainLayers = {
     archive:    { color: '#CD5C5C' },
     cadastre:   { color: '#87CEEB' },
     land:       { color: '#FF69B4' },
 };
+const atuLayers = {
+    village:    { weight: 1, minZoom: 11 },
+    council:    { weight: 1.5, minZoom: minZoom },
+    district:   { weight: 2.5, minZoom: minZoom },
+};
 
 
 
@@ -28,6 +32,29 @@ function saveHistory(message) {
     }).catch(error => console.error('Error saving history:', error));
 };
 
+const loadParcels = async (cadnums) => {
+    const missing = cadnums.filter((cadnum) => !coordinates.has(cadnum));
+
+    if (missing.length) {
+        const response = await fetch('/cadastral_map/parcels/batch', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ cadnums: missing }),
+        });
+        if (!response.ok) {
+            throw new Error('Failed to fetch parcels data');
+        };
+
+        const data = await response.json();
+        data.features.forEach((feature) => coordinates.set(feature.properties.cadnum, feature.geometry.coordinates));
+        data.not_found.forEach((cadnum) => coordinates.set(cadnum, null));
+    };
+
+    return cadnums.filter((cadnum) => coordinates.get(cadnum));
+};
+
 const polygonAction = async (data, method) => {
     try {
         const response = await fetch('/cadastral_map/parcels', {
@@ -232,8 +259,8 @@ loadData().then(() => {
         if (Object.prototype.hasOwnProperty.call(mainLayers, key)) {
             const layerConfig = mainLayers[key];
             layerConfig.overlay = L.vectorGrid.protobuf(
-                `${baseUrl}/geoserver/gwc/service/tms/1.0.0/grosland:${key}@EPSG%3A900913@pbf/{z}/{x}/{-y}.pbf`, {
-                    minZoom: (minZoom + maxZoom) / 2,
+                `/tiles/${key}/{z}/{x}/{y}.pbf`, {
+                    minZoom: minZoom + 1,
                     maxZoom: maxZoom,
                     interactive: true,
                     getFeatureId: (feature) => feature.properties.cadnum,
@@ -385,17 +412,16 @@ loadData().then(() => {
 
 
     //  ATU Layers -----------------------------------------------------------------------------------------------------
-    ['village', 'council', 'district'].forEach((item) => {
-        const minZoomLevel = item === 'village' ? 13 : minZoom;
-        L.tileLayer.wms(`${baseUrl}/geoserver/wms`, {
-            layers: `grosland:${item}`,
-            format: 'image/png',
-            minZoom: minZoomLevel,
-            transparent: true,
-            version: '1.1.0',
-            zIndex: 3,
+    for (const [key, layerConfig] of Object.entries(atuLayers)) {
+        L.vectorGrid.protobuf(`/tiles/${key}/{z}/{x}/{y}.pbf`, {
+            minZoom: layerConfig.minZoom,
+            maxZoom: maxZoom,
+            interactive: false,
+            vectorTileLayerStyles: {
+                [key]: { stroke: true, color: '#000000', weight: layerConfig.weight, fill: false },
+            },
         }).addTo(map);
-    });
+    };
 
 
     //  Create Filter --------------------------------------------------------------------------------------------------
@@ -413,6 +439,47 @@ loadData().then(() => {
 
     //  Search cadnum in .db -----------------------------------------------------------------------------------------------
     $(document).ready(function() {
+        //  Search a pasted list of cadnums with one request -----------------------------------------------------------
+        $('#cadnum').on('paste', async function(event) {
+            const pasted = event.originalEvent.clipboardData.getData('text').match(/\d{10}:\d{2}:\d{3}:\d{4}/g) || [];
+            const cadnums = [...new Set(pasted)];
+
+            if (cadnums.length < 2) {
+                return;
+            };
+            event.preventDefault();
+
+            try {
+                const found = await loadParcels(cadnums);
+
+                if (found.length) {
+                    const outline = L.geoJSON({
+                        "type": "FeatureCollection",
+                        "features": found.map((cadnum) => ({
+                            "type": "Feature",
+                            "geometry": {
+                                "type": "MultiPolygon",
+                                "coordinates": coordinates.get(cadnum),
+                            },
+                        })),
+                    }, {
+                        style: { color: 'red', fill: false },
+                    }).addTo(map);
+
+                    map.fitBounds(outline.getBounds());
+                };
+
+                const notFound = cadnums.filter((cadnum) => !coordinates.get(cadnum));
+                if (notFound.length) {
+                    window.alert('Земельні ділянки з кадастровими номерами ' + notFound.join(', ') + ' відсутні.');
+                };
+
+                saveHistory('Batch search ' + cadnums.length);
+            } catch (error) {
+                console.error('Error fetching parcels data:', error);
+            };
+        });
+
         $('#input').on('submit', async function(event) {
             event.preventDefault();
 
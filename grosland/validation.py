@@ -0,0 +1,251 @@
+from collections import deque
+from itertools import islice
+import csv
+import multiprocessing
+import numpy as np
+import os
+import shapely
+
+
+#   Parameters ---------------------------------------------------------------------------------------------------------
+#   Authalic radius of WGS 84, areas on this sphere differ from the ellipsoidal ones by less than 0.5% in Ukraine
+EARTH_RADIUS = 6371007.2
+
+#   Declared and geodesic areas (ha) may differ by 5% of the declared area, but always by 0.01 ha
+AREA_TOLERANCE = 0.05
+AREA_MIN_DIFFERENCE = 0.01
+
+POLYGON_TYPE_ID = 3
+
+SELF_INTERSECTIONS = ("Self-intersection", "Ring Self-intersection")
+
+REPORT_COLUMNS = ("cadnum", "status", "reason", "declared_area", "area")
+
+SUMMARY_KEYS = ("count", "repaired", "rejected", "area_mismatch")
+
+
+#   Geometry -----------------------------------------------------------------------------------------------------------
+def geodesic_area(geometries) -> np.ndarray:
+    """
+        Area of the geometries in hectares on the sphere, computed for all rings at once with the spherical excess
+        formula (Chamberlain & Duquette). Holes are subtracted regardless of the orientation of the rings.
+    :param geometries: Array of polygons and multipolygons in EPSG:4326.
+    :return: Array of areas
+    """
+    geometries = np.asarray(geometries, dtype=object)
+
+    parts, part_index = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coordinates, coordinate_ring = shapely.get_coordinates(rings, return_index=True)
+
+    lng, lat = np.radians(coordinates[:, 0]), np.radians(coordinates[:, 1])
+    edges = coordinate_ring[1:] == coordinate_ring[:-1]
+    excess = (lng[1:] - lng[:-1]) * (2 + np.sin(lat[:-1]) + np.sin(lat[1:]))
+
+    ring_area = np.abs(np.bincount(
+        coordinate_ring[:-1][edges], weights=excess[edges], minlength=len(rings)
+    )) * EARTH_RADIUS ** 2 / 2
+
+    #   The first ring of every polygon is the exterior one
+    exterior = np.ones(len(rings), dtype=bool)
+    exterior[1:] = ring_part[1:] != ring_part[:-1]
+
+    part_area = np.bincount(ring_part, weights=np.where(exterior, ring_area, -ring_area), minlength=len(parts))
+
+    return np.bincount(part_index, weights=part_area, minlength=len(geometries)) / 10000
+
+
+def polygonal(geometries) -> np.ndarray:
+    """
+        MultiPolygons of the polygonal parts of the geometries. Lines and points, which make_valid leaves
+        from collapsed rings, are dropped.
+    :return: Array of MultiPolygons, None where no polygon is left
+    """
+    geometries = np.asarray(geometries, dtype=object)
+
+    #   Collections of make_valid may contain MultiPolygons, so the parts are exploded twice
+    parts, index = shapely.get_parts(geometries, return_index=True)
+    parts, part_index = shapely.get_parts(parts, return_index=True)
+    index = index[part_index]
+
+    polygons = (shapely.get_type_id(parts) == POLYGON_TYPE_ID) & ~shapely.is_empty(parts)
+    result = np.full(len(geometries), None, dtype=object)
+
+    if polygons.any():
+        shapely.multipolygons(parts[polygons], indices=index[polygons], out=result)
+
+    return result
+
+
+def validate_geometries(geometries, areas=None, tolerance: float = AREA_TOLERANCE) -> dict:
+    """
+        Check and repair the geometries of plots with vectorized GEOS operations.
+        Invalid geometries are repaired with make_valid, the ones without a polygon left are rejected.
+    :param geometries: Array of polygons and multipolygons in EPSG:4326.
+    :param areas: Declared areas in hectares or None.
+    :param tolerance: Allowed relative difference between the declared and the geodesic area.
+    :return: {
+        "geometry": array of MultiPolygons (None for rejected),
+        "status": array of "valid", "repaired" or "rejected",
+        "reason": array of the GEOS reasons of invalid geometries (None for valid),
+        "self_intersection": bool array,
+        "area": array of geodesic areas in hectares,
+        "area_mismatch": bool array, False without declared areas,
+    }
+    """
+    geometries = np.asarray(geometries, dtype=object)
+
+    valid = shapely.is_valid(geometries)
+    reason = np.full(len(geometries), None, dtype=object)
+    reason[~valid] = shapely.is_valid_reason(geometries[~valid])
+    reason[shapely.is_missing(geometries)] = "Missing geometry"
+
+    repaired = geometries.copy()
+    repaired[~valid] = shapely.make_valid(geometries[~valid])
+    result = polygonal(repaired)
+
+    rejected = shapely.is_missing(result)
+    area = np.zeros(len(geometries))
+    area[~rejected] = geodesic_area(result[~rejected])
+
+    if areas is None:
+        mismatch = np.zeros(len(geometries), dtype=bool)
+    else:
+        areas = np.asarray(areas, dtype=float)
+        mismatch = ~rejected & (np.abs(area - areas) > np.maximum(areas * tolerance, AREA_MIN_DIFFERENCE))
+
+    return {
+        "geometry": result,
+        "status": np.where(rejected, "rejected", np.where(valid, "valid", "repaired")),
+        "reason": reason,
+        "self_intersection": np.array([str(item).startswith(SELF_INTERSECTIONS) for item in reason], dtype=bool),
+        "area": area,
+        "area_mismatch": mismatch,
+    }
+
+
+#   Rows ---------------------------------------------------------------------------------------------------------------
+def declared_area(value) -> float:
+    """
+        Declared area of a row in hectares.
+    :return: Area or NaN if it is missing, not a number or negative
+    """
+    try:
+        area = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+    return area if np.isfinite(area) and area >= 0 else np.nan
+
+
+def validate_rows(rows, tolerance: float = AREA_TOLERANCE) -> dict:
+    """
+        Validate COPY rows (cadnum, ownership_code, purpose_code, area, address, EWKT geometry) of the importer
+        and the sync jobs. Geometries of the accepted rows are replaced by the repaired MultiPolygons as hex EWKB.
+        Rows without a geometry or with an invalid declared area are rejected.
+    :return: {
+        "rows": [accepted rows],
+        "count": int, "repaired": int, "rejected": int, "area_mismatch": int,
+        "rejected_cadnums": [cadastral numbers of the rejected rows],
+        "entries": [report rows of repaired, rejected and area mismatches],
+    }
+    """
+    rows = list(rows)
+    geometries = shapely.from_wkt([row[-1] and row[-1].split(";", 1)[-1] for row in rows], on_invalid="ignore")
+    areas = np.array([declared_area(row[3]) for row in rows], dtype=float)
+    result = validate_geometries(geometries, areas, tolerance)
+
+    invalid_area = np.isnan(areas)
+    status = np.where(invalid_area, "rejected", result["status"])
+    accepted = status != "rejected"
+    ewkb = np.full(len(rows), None, dtype=object)
+    ewkb[accepted] = shapely.to_wkb(
+        shapely.set_srid(result["geometry"][accepted], 4326), hex=True, include_srid=True
+    )
+
+    entries = []
+    for index, row in enumerate(rows):
+        mismatch = result["area_mismatch"][index]
+
+        if status[index] != "valid" or mismatch:
+            reason = "; ".join(item for item in (
+                result["reason"][index],
+                "Invalid area" if invalid_area[index] else None,
+                "Area mismatch" if mismatch else None,
+            ) if item)
+            entries.append((row[0], status[index], reason, row[3], round(float(result["area"][index]), 4)))
+
+    return {
+        "rows": [(*row[:-1], ewkb[index]) for index, row in enumerate(rows) if accepted[index]],
+        "count": len(rows),
+        "repaired": int((status == "repaired").sum()),
+        "rejected": int((~accepted).sum()),
+        "area_mismatch": int(result["area_mismatch"].sum()),
+        "rejected_cadnums": [row[0] for index, row in enumerate(rows) if not accepted[index]],
+        "entries": entries,
+    }
+
+
+def validate_chunks(chunks, processes: int = None):
+    """
+        Validate chunks of rows in a process pool, the results keep the order of the chunks.
+        At most two chunks per process are in flight, so the workers never run ahead of the consumer
+        (COPY or the sync upsert) and memory stays bounded for files of any size.
+    :param chunks: Iterable of lists of rows.
+    :param processes: Number of worker processes, by default the number of CPUs, 1 validates in this process.
+    :return: Generator of validate_rows results
+    """
+    if processes == 1:
+        yield from map(validate_rows, chunks)
+        return
+
+    limit = (processes or os.cpu_count() or 1) * 2
+    pending = deque()
+
+    with multiprocessing.Pool(processes) as pool:
+        for chunk in chunks:
+            pending.append(pool.apply_async(validate_rows, (chunk,)))
+
+            if len(pending) >= limit:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def validated_rows(rows, chunk_size: int = 5000, processes: int = None, report: str = None, summary: dict = None):
+    """
+        Stream the accepted rows of the validation stage, the report is appended to the CSV file as it goes.
+    :param report: Path of the CSV report or None.
+    :param summary: Dictionary, which is updated with the counters of validate_rows.
+    :return: Generator of rows
+    """
+    iterator = iter(rows)
+    chunks = iter(lambda: list(islice(iterator, chunk_size)), [])
+
+    for result in validate_chunks(chunks, processes):
+        if report:
+            write_report(report, result["entries"])
+
+        if summary is not None:
+            for key in SUMMARY_KEYS:
+                summary[key] = summary.get(key, 0) + result[key]
+
+        yield from result["rows"]
+
+
+def write_report(path: str, entries: list):
+    """
+        Append the entries to the CSV report of the validation, the header is written to a new file.
+    """
+    new = not os.path.exists(path)
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "a", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+
+        if new:
+            writer.writerow(REPORT_COLUMNS)
+        writer.writerows(entries)
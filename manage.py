@@ -1,7 +1,181 @@
+from flask.cli import FlaskGroup
 from grosland import create_app
+from grosland.app import get_engine, init_db
+from grosland.assets import build_bundles
+from grosland.blueprints.tiles import LAYERS, USER_LAYERS
+from grosland.export import EXPORT_FORMATS, EXPORT_MODELS
+from grosland.mbtiles import DEFAULT_LAYERS, build_mbtiles
+import click
+import functions
+import os
+import sys
 
 
 app = create_app()
+cli = FlaskGroup(create_app=lambda: app)
+
+
+#   Commands -----------------------------------------------------------------------------------------------------------
+@app.cli.command("create-db")
+def create_db():
+    """
+        Create missing tables, triggers and views of an empty database.
+    """
+    init_db()
+    click.echo("Database created")
+
+
+@app.cli.command("sync-diff")
+@click.argument("services_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("koatuu")
+@click.option("--output-dir", default="temp", show_default=True, help="Directory for add_plot.txt and del_plot.txt.")
+@click.option("--grosland-file", type=click.Path(exists=True, dir_okay=False),
+              help="Compare with this file by a sorted merge instead of the database (for national lists).")
+def sync_diff(services_file, koatuu, output_dir, grosland_file):
+    """
+        Find plots added to and removed from the Geocadastre services list of the KOATUU.
+    """
+    if grosland_file:
+        result = functions.list_comparison(services_file, grosland_file, output_dir)
+    else:
+        result = functions.sync_diff(services_file, koatuu, output_dir)
+
+    click.echo(f"Added: {result['added']}, removed: {result['removed']}, unchanged: {result['unchanged']}")
+
+
+@app.cli.command("sync")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("koatuu")
+@click.option("--chunk-size", default=5000, show_default=True, help="Features processed in one transaction.")
+@click.option("--checkpoint-dir", default="temp/sync", show_default=True, help="Directory for checkpoints.")
+@click.option("--cadnum", default="cadnum", show_default=True, help="Property with the cadastral number.")
+@click.option("--ownership-code", default="ownership_code", show_default=True, help="Property with the ownership.")
+@click.option("--purpose-code", default="purpose_code", show_default=True, help="Property with the purpose.")
+@click.option("--area", default="area", show_default=True, help="Property with the area.")
+@click.option("--address", default="address", show_default=True, help="Property with the address.")
+@click.option("--processes", type=int, help="Geometry validation processes, by default the number of CPUs.")
+def sync(file, koatuu, chunk_size, checkpoint_dir, processes, **kwargs):
+    """
+        Synchronize the cadastre layer of the KOATUU with a fresh Geocadastre services geojson.
+        An interrupted run resumes from its last checkpoint when started again with the same file.
+    """
+    result = functions.sync_cadastre(file, koatuu, chunk_size, checkpoint_dir, processes, **kwargs)
+
+    click.echo(", ".join(f"{key}: {value}" for key, value in result.items()))
+
+
+@app.cli.command("import")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--layer", type=click.Choice(["cadastre", "archive"]), default="cadastre", show_default=True)
+@click.option("--chunk-size", default=5000, show_default=True, help="Rows sent to the database by one COPY.")
+@click.option("--processes", type=int, help="Geometry validation processes, by default the number of CPUs.")
+@click.option("--report", type=click.Path(dir_okay=False), help="CSV report of repaired and rejected geometries.")
+@click.option("--cadnum", default="cadnum", show_default=True, help="Property with the cadastral number.")
+@click.option("--ownership-code", default="ownership_code", show_default=True, help="Property with the ownership.")
+@click.option("--purpose-code", default="purpose_code", show_default=True, help="Property with the purpose.")
+@click.option("--area", default="area", show_default=True, help="Property with the area.")
+@click.option("--address", default="address", show_default=True, help="Property with the address.")
+def import_plots(**kwargs):
+    """
+        Import the plots of a geojson file into the cadastre or archive layer, geometries are validated on the way.
+    """
+    result = functions.create_db_object(**kwargs)
+
+    click.echo(f"Added: {result['added']}, repaired: {result['repaired']}, rejected: {result['rejected']}, "
+               f"area mismatches: {result['area_mismatch']}, report: {result['report']}")
+
+
+@app.cli.command("statistics")
+@click.option("--assign-atu", is_flag=True, help="Reassign all plots to councils and villages first.")
+def statistics(assign_atu):
+    """
+        Refresh the materialized plot statistics by council, village, ownership and purpose.
+    """
+    if assign_atu:
+        result = functions.assign_atu()
+        click.echo(", ".join(f"{key}: {value}" for key, value in result.items()))
+    else:
+        functions.refresh_statistics()
+
+    click.echo("Statistics refreshed")
+
+
+@app.cli.command("export")
+@click.argument("koatuu")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--layer", type=click.Choice(list(EXPORT_MODELS)), default="cadastre", show_default=True)
+@click.option("--format", "output_format", type=click.Choice(list(EXPORT_FORMATS)),
+              help="Output format, by default from the extension of the output file.")
+def export(koatuu, output, layer, output_format):
+    """
+        Export the plots of the KOATUU for desktop GIS (CSV, GeoJSONSeq, FlatGeobuf or GeoPackage).
+    """
+    if output_format is None:
+        extension = os.path.splitext(output)[1].lstrip(".").lower()
+        output_format = next((key for key, value in EXPORT_FORMATS.items() if value[1] == extension), None)
+
+        if output_format is None:
+            raise click.BadParameter(f"Unknown extension {extension!r}, use --format", param_hint="output")
+
+    try:
+        size = functions.export_to_file(koatuu, layer, output_format, output, app.config["GEOJSON_PRECISION"])
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="koatuu")
+
+    click.echo(f"{output}: {size} bytes")
+
+
+@app.cli.command("build-mbtiles")
+@click.argument("code")
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--min-zoom", default=10, show_default=True, type=int)
+@click.option("--max-zoom", default=16, show_default=True, type=int)
+@click.option("--layer", "layers", type=click.Choice([layer for layer in LAYERS if layer not in USER_LAYERS]),
+              multiple=True, help="Layer of the package, can be repeated. By default all of them.")
+@click.option("--processes", type=int, help="Rendering processes, by default the number of CPUs.")
+def build_mbtiles_command(code, output, min_zoom, max_zoom, layers, processes):
+    """
+        Pre-render the tiles of a council or village (CODE) into an MBTiles file for an offline deployment
+        with TILES_MBTILES.
+    """
+    if not 0 <= min_zoom <= max_zoom <= 22:
+        raise click.BadParameter("Zooms must satisfy 0 <= min-zoom <= max-zoom <= 22", param_hint="--min-zoom")
+
+    try:
+        result = build_mbtiles(get_engine(), output, code, min_zoom, max_zoom, layers or DEFAULT_LAYERS, processes)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="code")
+
+    click.echo(f"{output}: {result['tiles']} tiles, {result['unique']} unique, {result['empty']} empty")
+
+
+@app.cli.command("build-assets")
+def build_assets():
+    """
+        Build fingerprinted and precompressed JS/CSS bundles of the pages into static/dist.
+        The workers pick up the new bundles after a restart.
+    """
+    try:
+        manifest = build_bundles(app.static_folder, app.static_url_path)
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+
+    for page, files in manifest.items():
+        click.echo(f"{page}: {', '.join(files.values())}")
+
+
+@app.cli.command("replicas")
+def replicas():
+    """
+        Check that the read replicas are in recovery and show their replication lag.
+    """
+    for uri, status in functions.replication_lag().items():
+        lag = "unknown" if status["lag"] is None else f"{status['lag']:.3f} s"
+        click.echo(f"{uri}: {'replica' if status['in_recovery'] else 'NOT IN RECOVERY'}, lag {lag}")
+
 
 if __name__ == "__main__":
-    app.run()
+    if len(sys.argv) > 1:
+        cli()
+    else:
+        app.run()
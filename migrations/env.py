@@ -3,7 +3,7 @@ from logging.config import fileConfig
 from sqlalchemy import engine_from_config, pool
 from alembic import context
 
-from grosland.app import Base
+from grosland.models import Base
 from config import Config
 
 
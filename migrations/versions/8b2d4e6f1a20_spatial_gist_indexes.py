@@ -0,0 +1,33 @@
+"""spatial gist indexes
+
+Revision ID: 8b2d4e6f1a20
+Revises: 3f1c2a7b9d10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2d4e6f1a20'
+down_revision: Union[str, None] = '3f1c2a7b9d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+#   Names match the indexes GeoAlchemy2 creates with create_all, so existing databases are left untouched
+TABLES = ("state", "district", "council", "village", "cadastre", "archive", "land", "ascm")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_geometry ON {table} USING gist (geometry)")
+        op.execute(f"ANALYZE {table}")
+
+
+def downgrade() -> None:
+    #   The indexes may predate this revision (create_all) and the queries depend on them, so they are kept
+    pass
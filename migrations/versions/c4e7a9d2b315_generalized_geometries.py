@@ -0,0 +1,58 @@
+"""generalized geometries
+
+Revision ID: c4e7a9d2b315
+Revises: 8b2d4e6f1a20
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e7a9d2b315'
+down_revision: Union[str, None] = '8b2d4e6f1a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ("state", "district", "council", "village", "cadastre", "archive", "land")
+
+#   Zoom and tolerance of one 256 px tile pixel in degrees, the same as grosland.models.GENERALIZATION_ZOOMS
+LEVELS = {zoom: 360 / (256 * 2 ** zoom) for zoom in (8, 10, 12)}
+
+
+def simplified(zoom: int, column: str = "geometry") -> str:
+    return f"ST_Multi(ST_SimplifyPreserveTopology({column}, {LEVELS[zoom]}))"
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE OR REPLACE FUNCTION generalize_geometry() RETURNS trigger AS $$ BEGIN "
+        + " ".join(f"NEW.geometry_z{zoom} := {simplified(zoom, 'NEW.geometry')};" for zoom in LEVELS)
+        + " RETURN NEW; END; $$ LANGUAGE plpgsql"
+    )
+
+    for table in TABLES:
+        for zoom in LEVELS:
+            op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS geometry_z{zoom} geometry(MULTIPOLYGON, 4326)")
+
+        op.execute(f"UPDATE {table} SET " + ", ".join(f"geometry_z{zoom} = {simplified(zoom)}" for zoom in LEVELS))
+
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_generalize ON {table}")
+        op.execute(
+            f"CREATE TRIGGER {table}_generalize BEFORE INSERT OR UPDATE OF geometry ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION generalize_geometry()"
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_generalize ON {table}")
+
+        for zoom in LEVELS:
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS geometry_z{zoom}")
+
+    op.execute("DROP FUNCTION IF EXISTS generalize_geometry()")
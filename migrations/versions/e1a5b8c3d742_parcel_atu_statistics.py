@@ -0,0 +1,79 @@
+"""parcel atu statistics
+
+Revision ID: e1a5b8c3d742
+Revises: c4e7a9d2b315
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a5b8c3d742'
+down_revision: Union[str, None] = 'c4e7a9d2b315'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLES = ("cadastre", "archive")
+COLUMNS = ("council_code", "village_code")
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE OR REPLACE FUNCTION assign_atu() RETURNS trigger AS $$ "
+        "DECLARE location geometry := ST_PointOnSurface(NEW.geometry); BEGIN "
+        "NEW.council_code := (SELECT code FROM council WHERE ST_Intersects(council.geometry, location) "
+        "ORDER BY code LIMIT 1); "
+        "NEW.village_code := (SELECT code FROM village WHERE ST_Intersects(village.geometry, location) "
+        "ORDER BY code LIMIT 1); "
+        "RETURN NEW; END; $$ LANGUAGE plpgsql"
+    )
+
+    for table in TABLES:
+        for column in COLUMNS:
+            op.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} varchar")
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})")
+
+        op.execute(f"""
+            UPDATE {table} t SET
+                council_code = (
+                    SELECT code FROM council a WHERE ST_Intersects(a.geometry, l.location) ORDER BY code LIMIT 1
+                ),
+                village_code = (
+                    SELECT code FROM village a WHERE ST_Intersects(a.geometry, l.location) ORDER BY code LIMIT 1
+                )
+            FROM (SELECT id, ST_PointOnSurface(geometry) AS location FROM {table}) l
+            WHERE l.id = t.id
+        """)
+
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_assign_atu ON {table}")
+        op.execute(
+            f"CREATE TRIGGER {table}_assign_atu BEFORE INSERT OR UPDATE OF geometry ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION assign_atu()"
+        )
+
+    op.execute(
+        "CREATE MATERIALIZED VIEW IF NOT EXISTS parcel_statistics AS "
+        "SELECT council_code, village_code, ownership_code, purpose_code, count(*) AS count, sum(area) AS area "
+        "FROM cadastre GROUP BY council_code, village_code, ownership_code, purpose_code"
+    )
+    op.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_parcel_statistics_key "
+        "ON parcel_statistics (council_code, village_code, ownership_code, purpose_code)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS parcel_statistics")
+
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_assign_atu ON {table}")
+
+        for column in COLUMNS:
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {column}")
+
+    op.execute("DROP FUNCTION IF EXISTS assign_atu()")
@@ -0,0 +1,102 @@
+from grosland import export
+import csv
+import io
+import json
+import shapely
+import sqlite3
+import struct
+
+
+SQUARE = shapely.from_wkt("MULTIPOLYGON(((30 47, 30.01 47, 30.01 47.01, 30 47.01, 30 47)))")
+FAR_SQUARE = shapely.from_wkt("MULTIPOLYGON(((31 46, 31.5 46, 31.5 46.5, 31 46.5, 31 46)))")
+
+
+def properties(index: int) -> tuple:
+    return f"5121680800:01:001:{index:04d}", "100", "01.01", 84.32, f"address {index}"
+
+
+def gpkg_row(index: int, geometry) -> tuple:
+    xmin, ymin, xmax, ymax = shapely.bounds(geometry)
+    return *properties(index), shapely.to_wkb(geometry, byte_order=1), xmin, xmax, ymin, ymax
+
+
+def test_gpkg_geometry_header():
+    wkb = shapely.to_wkb(SQUARE, byte_order=1)
+    blob = export.gpkg_geometry(wkb, 30, 30.01, 47, 47.01)
+
+    magic, version, flags, srs_id = struct.unpack_from("<2sBBi", blob)
+    assert (magic, version, srs_id) == (b"GP", 0, 4326)
+    #   Little endian, envelope of minx, maxx, miny, maxy, not empty
+    assert flags == 0b011
+    assert struct.unpack_from("<4d", blob, 8) == (30, 30.01, 47, 47.01)
+    assert blob[40:] == wkb
+
+
+def test_write_gpkg(tmp_path):
+    path = str(tmp_path / "cadastre.gpkg")
+    rows = [gpkg_row(0, SQUARE), gpkg_row(1, FAR_SQUARE), gpkg_row(2, SQUARE)]
+
+    #   The last batch is smaller than the batch size
+    assert export.write_gpkg(path, "cadastre", rows, batch_size=2) == 3
+
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute("PRAGMA application_id").fetchone()[0] == 0x47504B47
+        assert connection.execute(
+            "SELECT min_x, min_y, max_x, max_y, srs_id FROM gpkg_contents WHERE table_name = 'cadastre'"
+        ).fetchone() == (30, 46, 31.5, 47.01, 4326)
+        assert connection.execute(
+            "SELECT geometry_type_name, srs_id FROM gpkg_geometry_columns WHERE table_name = 'cadastre'"
+        ).fetchone() == ("MULTIPOLYGON", 4326)
+
+        features = connection.execute(
+            "SELECT geometry, cadnum, ownership_code, purpose_code, area, address FROM cadastre ORDER BY fid"
+        ).fetchall()
+    finally:
+        connection.close()
+
+    assert [feature[1:] for feature in features] == [properties(index) for index in range(3)]
+    assert struct.unpack_from("<4d", features[1][0], 8) == (31, 31.5, 46, 46.5)
+    assert shapely.equals(shapely.from_wkb(features[1][0][40:]), FAR_SQUARE)
+
+
+def test_write_gpkg_without_rows(tmp_path):
+    path = str(tmp_path / "land.gpkg")
+
+    assert export.write_gpkg(path, "land", []) == 0
+
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute("SELECT min_x, max_y FROM gpkg_contents").fetchone() == (None, None)
+    finally:
+        connection.close()
+
+
+def test_csv_chunks_end_at_rows(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 200)
+    rows = [(*properties(index), shapely.to_wkt(SQUARE)) for index in range(10)]
+
+    chunks = list(export.csv_chunks(rows))
+
+    assert len(chunks) > 2
+    assert all(chunk.endswith(b"\r\n") for chunk in chunks)
+    assert list(csv.reader(io.StringIO(b"".join(chunks).decode()))) == [
+        [*export.EXPORT_COLUMNS, "wkt"], *([str(value) for value in row] for row in rows)
+    ]
+
+
+def test_geojsonseq_chunks_end_at_features(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_SIZE", 300)
+    geometry = shapely.to_geojson(SQUARE)
+    rows = [(*properties(index), geometry) for index in range(10)]
+
+    chunks = list(export.geojsonseq_chunks(rows))
+
+    assert len(chunks) > 2
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
+
+    features = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert [feature["properties"] for feature in features] == [
+        dict(zip(export.EXPORT_COLUMNS, properties(index))) for index in range(10)
+    ]
+    assert all(feature["geometry"] == json.loads(geometry) for feature in features)
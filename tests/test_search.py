@@ -0,0 +1,41 @@
+from grosland.blueprints.cadastral_map import decode_cursor, encode_cursor, search_filters
+from grosland.models import Cadastre, Archive, Land
+import base64
+import json
+import pytest
+
+
+def test_cursor_round_trip():
+    for model in (Cadastre, Archive):
+        assert decode_cursor(encode_cursor(model, "5121680800:01:001:0001")) == (model, "5121680800:01:001:0001")
+
+    assert decode_cursor("") is None
+    assert decode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b"[]").decode(),
+    base64.urlsafe_b64encode(json.dumps({"cadnum": "5121680800:01:001:0001"}).encode()).decode(),
+    #   Only the search layers can be paged
+    encode_cursor(Land, "1"),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_search_filters_escape_like_wildcards():
+    query_filter, = search_filters(Cadastre, {"address": "50%_a\\b"})
+
+    assert query_filter.right.value == "%50\\%\\_a\\\\b%"
+    assert query_filter.modifiers["escape"] == "\\"
+
+
+def test_search_filters_area():
+    query_filters = search_filters(Cadastre, {"area": ">=1,5", "cadnum": "5121680800"})
+
+    assert [item.right.value for item in query_filters] == ["%5121680800%", 1.5]
+    assert search_filters(Cadastre, {"area": ">=abc"}) == []
+    assert search_filters(Cadastre, {"area": "~~1"}) == []
@@ -0,0 +1,90 @@
+import json
+import os
+import pytest
+
+
+#   The test truncates the lots tables, so it runs only against a PostGIS database named *_test
+DATABASE_URI = os.environ.get("GROSLAND_TEST_DATABASE_URI", "")
+
+pytestmark = pytest.mark.skipif(
+    not DATABASE_URI.rsplit("/", 1)[-1].endswith("_test"),
+    reason="GROSLAND_TEST_DATABASE_URI of a *_test PostGIS database is not set"
+)
+
+KOATUU = "5121680800"
+KEPT = "5121680800:01:001:0001"
+UPDATED = "5121680800:01:001:0002"
+
+
+def feature(cadnum: str, coordinates: list, area: float) -> dict:
+    return {
+        "type": "Feature",
+        "properties": {
+            "cadnum": cadnum, "ownership_code": "100", "purpose_code": "01.01", "area": area, "address": "address"
+        },
+        "geometry": {"type": "Polygon", "coordinates": [coordinates]},
+    }
+
+
+@pytest.fixture
+def database():
+    from config import Config
+    from grosland import create_app
+    from grosland.app import init_db, session
+    from grosland.models import Cadastre, Archive, Ownership, Purpose
+    from sqlalchemy import text
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = DATABASE_URI
+        SQLALCHEMY_REPLICA_URIS = []
+        CACHE_TYPE = "NullCache"
+
+    create_app(TestConfig)
+    init_db()
+
+    session.execute(text(f"TRUNCATE {Cadastre.__tablename__}, {Archive.__tablename__} RESTART IDENTITY"))
+    for model, code in ((Ownership, "100"), (Purpose, "01.01")):
+        session.execute(
+            text(f'INSERT INTO {model.__tablename__} (code, "desc") VALUES (:code, :code) ON CONFLICT DO NOTHING'),
+            {"code": code}
+        )
+    session.commit()
+
+    yield session
+
+    session.remove()
+
+
+def test_rejected_geometry_keeps_existing_plot(database, tmp_path):
+    import functions
+    from grosland.models import Cadastre, Archive
+    from sqlalchemy import text
+
+    square = [[30, 47], [30.01, 47], [30.01, 47.01], [30, 47.01], [30, 47]]
+    ewkt = "SRID=4326;MULTIPOLYGON(((30 47, 30.01 47, 30.01 47.01, 30 47.01, 30 47)))"
+
+    functions.copy_rows(Cadastre.__tablename__, functions.COPY_COLUMNS, [
+        (KEPT, "100", "01.01", 84.32, "address", ewkt),
+        (UPDATED, "100", "01.01", 84.32, "address", ewkt),
+    ])
+
+    #   The geometry of the kept plot collapsed to a line in the fresh file
+    services = tmp_path / "services.geojson"
+    services.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        feature(KEPT, [[30, 47], [30.01, 47], [30.01, 47], [30, 47]], 84.32),
+        feature(UPDATED, square, 84.3),
+    ]}))
+
+    result = functions.sync_cadastre(
+        str(services), KOATUU, chunk_size=10, checkpoint_dir=str(tmp_path / "sync"), processes=1,
+        cadnum="cadnum", ownership_code="ownership_code", purpose_code="purpose_code", area="area", address="address"
+    )
+
+    assert result["rejected"] == 1
+    assert result["changed"] == 1
+    assert result["archived"] == 0
+
+    cadastre = database.execute(text(f"SELECT cadnum, ST_AsEWKT(geometry) FROM {Cadastre.__tablename__}")).all()
+    assert sorted(cadnum for cadnum, _ in cadastre) == [KEPT, UPDATED]
+    assert dict(cadastre)[KEPT] == ewkt.replace(", ", ",")
+    assert database.execute(text(f"SELECT count(*) FROM {Archive.__tablename__}")).scalar() == 0
@@ -0,0 +1,80 @@
+from functions import feature_to_row
+from grosland.validation import validate_chunks, validate_rows
+import itertools
+
+
+VALID = "SRID=4326;POLYGON((30 47, 30.01 47, 30.01 47.01, 30 47.01, 30 47))"
+SELF_INTERSECTING = "SRID=4326;POLYGON((30 47, 30.01 47.01, 30.01 47, 30 47.01, 30 47))"
+COLLAPSED = "SRID=4326;POLYGON((30 47, 30.01 47, 30.01 47, 30 47))"
+
+
+def row(cadnum: str, geometry: str, area: float = 84.32) -> tuple:
+    return cadnum, "100", "01.01", area, "address", geometry
+
+
+def test_validate_rows():
+    result = validate_rows([
+        row("5121680800:01:001:0001", VALID),
+        row("5121680800:01:001:0002", SELF_INTERSECTING, 42.16),
+        row("5121680800:01:001:0003", COLLAPSED),
+        row("5121680800:01:001:0004", "SRID=4326;garbage"),
+    ])
+
+    assert result["count"] == 4
+    assert result["repaired"] == 1
+    assert result["rejected"] == 2
+    assert result["area_mismatch"] == 0
+    assert result["rejected_cadnums"] == ["5121680800:01:001:0003", "5121680800:01:001:0004"]
+    assert [item[0] for item in result["rows"]] == ["5121680800:01:001:0001", "5121680800:01:001:0002"]
+    assert all(item[-1].startswith("0106000020E6100000") for item in result["rows"])
+
+
+def test_validate_rows_area_mismatch():
+    result = validate_rows([row("5121680800:01:001:0001", VALID, 70.0)])
+
+    assert result["area_mismatch"] == 1
+    assert result["entries"][0][1:3] == ("valid", "Area mismatch")
+
+
+def test_validate_rows_rejects_invalid_areas():
+    result = validate_rows([
+        row("5121680800:01:001:0001", VALID, "84.32"),
+        row("5121680800:01:001:0002", VALID, "abc"),
+        row("5121680800:01:001:0003", VALID, None),
+    ])
+
+    assert result["rejected_cadnums"] == ["5121680800:01:001:0002", "5121680800:01:001:0003"]
+    assert [entry[1:3] for entry in result["entries"]] == [("rejected", "Invalid area")] * 2
+    assert [item[0] for item in result["rows"]] == ["5121680800:01:001:0001"]
+
+
+def test_feature_without_geometry_is_rejected():
+    mapping = {key: key for key in ("cadnum", "ownership_code", "purpose_code", "area", "address")}
+    properties = {"cadnum": "5121680800:01:001:0001", "ownership_code": 100, "purpose_code": "01.01", "address": ""}
+
+    rows = [
+        feature_to_row({"type": "Feature", "properties": properties, "geometry": None}, **mapping),
+        feature_to_row({"type": "Feature", "properties": properties, "geometry": {"type": "Polygon"}}, **mapping),
+    ]
+    result = validate_rows(rows)
+
+    assert rows[0][3] is None and rows[0][-1] is None
+    assert result["rejected"] == 2
+    assert result["entries"][0][1:3] == ("rejected", "Missing geometry; Invalid area")
+
+
+def test_validate_chunks_keeps_order_and_bounds_pending_chunks():
+    pulled = itertools.count()
+
+    def chunks():
+        for index in range(20):
+            next(pulled)
+            yield [row(f"5121680800:01:001:{index:04d}", VALID)]
+
+    results = validate_chunks(chunks(), processes=2)
+    first = next(results)
+
+    #   Two chunks per process are in flight before the first result is consumed
+    assert next(pulled) == 4
+    cadnums = [item["rows"][0][0] for item in [first, *results]]
+    assert cadnums == [f"5121680800:01:001:{index:04d}" for index in range(20)]